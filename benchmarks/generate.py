@@ -0,0 +1,227 @@
+"""
+Generates synthetic C files for benchmarking lintern. Files are generated from
+a random seed, so the same seed and size always produce the same file. Each
+file is a sequence of functions containing the kinds of code that lintern
+rewrites: nested unbraced if/else chains and loops, multiple declarations on
+one line, uninitialized variables, functions declared with empty parameter
+lists, and unused function parameters. Generated files only use the C
+language itself (no #include directives), so they can be parsed anywhere.
+
+The default sizes include 1M and 5M files, which are quick to generate but
+slow to rewrite: with all rules enabled, about a minute for the 1M file and
+several minutes for the 5M file (and benchmarks/run.py rewrites them again for
+each rule). QUICK_SIZES leaves them out.
+
+Usage: python -m benchmarks.generate [-s SEED] [--sizes 1K,100K,5M] output_dir
+"""
+import os
+import sys
+import random
+import argparse
+
+
+DEFAULT_SIZES = ['1K', '10K', '100K', '1M', '5M']
+
+# Sizes for a quick run, without the slowest files
+QUICK_SIZES = ['1K', '10K', '100K']
+
+TYPES = ['int', 'unsigned int', 'long', 'short', 'char', 'float', 'double',
+         'unsigned char', 'long long']
+
+SIZE_SUFFIXES = {'K': 1024, 'M': 1024 * 1024}
+
+
+def parse_size(size):
+    """
+    Convert a size like '10K' or '5M' into a number of bytes
+    """
+    size = size.strip().upper()
+    if size and (size[-1] in SIZE_SUFFIXES):
+        return int(size[:-1]) * SIZE_SUFFIXES[size[-1]]
+
+    return int(size)
+
+
+class _FunctionGenerator(object):
+    def __init__(self, rng, name):
+        self.rng = rng
+        self.name = name
+        self.lines = []
+        self.vars = []
+
+    def line(self, depth, text):
+        self.lines.append(('    ' * depth) + text)
+
+    def expr(self):
+        a = self.rng.choice(self.vars)
+        b = self.rng.choice(self.vars + [str(self.rng.randint(0, 100))])
+        return '%s %s %s' % (a, self.rng.choice(['<', '>', '==', '!=', '+', '-']), b)
+
+    def simple_stmt(self, depth):
+        var = self.rng.choice(self.vars)
+        choice = self.rng.randint(0, 2)
+        if choice == 0:
+            self.line(depth, '%s = %s;' % (var, self.expr()))
+        elif choice == 1:
+            self.line(depth, '%s++;' % var)
+        else:
+            self.line(depth, '%s += %d;' % (var, self.rng.randint(1, 9)))
+
+    def declarations(self, depth):
+        # Multiple declarations on one line, some of them uninitialized
+        names = []
+        decls = []
+        for _ in range(self.rng.randint(1, 4)):
+            name = 'v%d' % (len(self.vars) + len(names))
+            names.append(name)
+            if self.rng.random() < 0.5:
+                decls.append('%s = %d' % (name, self.rng.randint(0, 50)))
+            else:
+                decls.append(name)
+
+        self.line(depth, '%s %s;' % (self.rng.choice(TYPES), ', '.join(decls)))
+        self.vars.extend(names)
+
+    def do_while(self, depth):
+        self.line(depth, 'do')
+        self.simple_stmt(depth + 1)
+        self.line(depth, 'while (%s);' % self.expr())
+
+    def block(self, depth, nesting, last):
+        # A single unbraced statement following if/else/for/while.
+        #
+        # BracesAroundCodeBlocks assumes that an unbraced block ends at the next
+        # top-level semicolon, so nested statements are limited to those where
+        # that holds: no do/while loops, no else branches, and no nested if
+        # statements unless this is the last branch of the enclosing if/else
+        # chain (otherwise the following else would belong to the nested if).
+        if (nesting <= 0) or (self.rng.random() < 0.4):
+            self.simple_stmt(depth)
+            return
+
+        choice = self.rng.randint(0 if last else 1, 2)
+        if choice == 0:
+            self.line(depth, 'if (%s)' % self.expr())
+            self.block(depth + 1, nesting - 1, last)
+        elif choice == 1:
+            self.line(depth, 'for (int i%d = 0; i%d < %d; i%d++)'
+                      % (depth, depth, self.rng.randint(2, 9), depth))
+            self.block(depth + 1, nesting - 1, last)
+        else:
+            self.line(depth, 'while (%s)' % self.expr())
+            self.block(depth + 1, nesting - 1, last)
+
+    def if_chain(self, depth, nesting):
+        num_else_ifs = self.rng.randint(0, 3)
+        has_else = self.rng.random() < 0.3
+
+        self.line(depth, 'if (%s)' % self.expr())
+        self.block(depth + 1, nesting, (num_else_ifs == 0) and (not has_else))
+
+        for i in range(num_else_ifs):
+            self.line(depth, 'else if (%s)' % self.expr())
+            self.block(depth + 1, nesting, (i == (num_else_ifs - 1)) and (not has_else))
+
+        if has_else:
+            self.line(depth, 'else')
+            self.block(depth + 1, nesting, True)
+
+    def generate(self):
+        num_params = self.rng.randint(0, 4)
+        params = ['%s p%d' % (self.rng.choice(TYPES), i) for i in range(num_params)]
+
+        # Only some of the parameters are used
+        self.vars = [('p%d' % i) for i in range(num_params) if self.rng.random() < 0.6]
+
+        if params:
+            signature = 'int %s(%s)' % (self.name, ', '.join(params))
+        else:
+            # Empty parameter list, rather than (void)
+            signature = 'int %s()' % self.name
+
+        self.line(0, signature)
+        self.line(0, '{')
+
+        self.declarations(1)
+        for _ in range(self.rng.randint(0, 2)):
+            self.declarations(1)
+
+        for _ in range(self.rng.randint(1, 4)):
+            choice = self.rng.random()
+            if choice < 0.7:
+                self.if_chain(1, self.rng.randint(0, 3))
+            elif choice < 0.8:
+                self.do_while(1)
+            else:
+                self.block(1, 2, True)
+
+        self.line(1, 'return %s;' % self.rng.choice(self.vars))
+        self.line(0, '}')
+        self.line(0, '')
+
+        return signature, self.lines
+
+
+def generate_source(size, seed):
+    """
+    Generate a C file of (at least) the given size
+
+    :param int size: minimum size of the generated file in bytes
+    :param int seed: random seed
+
+    :return: generated C source as a string
+    """
+    rng = random.Random(seed)
+    prototypes = []
+    bodies = []
+    total = 0
+
+    while total < size:
+        signature, lines = _FunctionGenerator(rng, 'func%d' % len(prototypes)).generate()
+        prototypes.append(signature + ';')
+        bodies.append('\n'.join(lines) + '\n')
+        total += len(bodies[-1]) + len(prototypes[-1]) + 1
+
+    return '\n'.join(prototypes) + '\n\n' + ''.join(bodies)
+
+
+def generate_corpus(output_dir, sizes=DEFAULT_SIZES, seed=0):
+    """
+    Write one generated C file for each of the given sizes
+
+    :param str output_dir: directory to write files to
+    :param sizes: list of sizes, e.g. ['1K', '5M']
+    :param int seed: random seed
+
+    :return: list of generated filenames
+    """
+    ret = []
+    os.makedirs(output_dir, exist_ok=True)
+
+    for size in sizes:
+        filename = os.path.join(output_dir, 'synth_%s_%d.c' % (size.upper(), seed))
+        with open(filename, 'w') as fh:
+            fh.write(generate_source(parse_size(size), seed))
+
+        ret.append(filename)
+
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--seed', default=0, type=int, dest='seed',
+                        help="Random seed")
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES), dest='sizes',
+                        help="Comma-separated list of file sizes to generate")
+    parser.add_argument('output_dir', help="Directory to write generated files to")
+    args = parser.parse_args()
+
+    for filename in generate_corpus(args.output_dir, args.sizes.split(','), args.seed):
+        print(filename)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+Measures lintern's throughput on a corpus of generated C files (see
+benchmarks/generate.py). Reports files/sec, tokens/sec and re-parses per file
+with all rules enabled, and then the time taken by each rule on its own (with
+only that rule enabled). Results can be written to a JSON file, so that runs
+can be compared.
+
+Generated files don't include any headers, so no compiler is needed to find
+system include directories; only libclang itself.
+
+A run with the default sizes takes well over five minutes, almost all of it
+spent on the 1M and 5M files, which are rewritten once with all rules and then
+once for each rule. Use --quick for a run that takes seconds (with --no-per-rule)
+or tens of seconds.
+
+Usage: python -m benchmarks.run [-s SEED] [--sizes 1K,1M | --quick] [-r REPEAT]
+                                [-o results.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+from lintern import __version__
+from lintern.config import rule_names
+from lintern.rewriter import CodeRewriter
+
+from benchmarks.generate import DEFAULT_SIZES, QUICK_SIZES, generate_corpus
+
+
+def rewriter_args():
+    # Stands in for the parsed command-line arguments that CodeRewriter expects
+    return argparse.Namespace(indent_type='space', indent_level=4, in_place=False, check=False,
+                              ignore_errors=False, cache_dir=None, cache_size=0,
+                              stats=False, stats_format='text', trace=None, filename=[],
+                              pch=False, pch_header=None)
+
+
+def bench_file(rewriter, filename, repeat):
+    """
+    Parse and rewrite a single file, repeat times, and return a dict of results
+    for the fastest run
+    """
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cf = rewriter._load_file(filename)
+        parse_time = time.perf_counter() - start
+
+        if cf.parsed is None:
+            raise RuntimeError(cf.error_report())
+
+        # Not timed; only needed for the token count
+        num_tokens = len(cf.tokens())
+
+        start = time.perf_counter()
+        if rewriter._rewrite_file(cf) is None:
+            raise RuntimeError(cf.error_report())
+
+        rewrite_time = time.perf_counter() - start
+
+        result = {
+            'file': os.path.basename(filename),
+            'bytes': os.path.getsize(filename),
+            'tokens': num_tokens,
+            'parse_time': parse_time,
+            'rewrite_time': rewrite_time,
+            'time': parse_time + rewrite_time,
+            'reparses': cf.parse_count - 1
+        }
+
+        if (best is None) or (result['time'] < best['time']):
+            best = result
+
+    return best
+
+
+def bench_corpus(filenames, config_data, repeat):
+    rewriter = CodeRewriter(rewriter_args(), config_data, filenames=[])
+    return [bench_file(rewriter, f, repeat) for f in filenames]
+
+
+def totals(results):
+    total_time = sum(r['time'] for r in results)
+    total_tokens = sum(r['tokens'] for r in results)
+
+    return {
+        'files': len(results),
+        'bytes': sum(r['bytes'] for r in results),
+        'tokens': total_tokens,
+        'time': total_time,
+        'files_per_sec': len(results) / total_time,
+        'tokens_per_sec': total_tokens / total_time,
+        'reparses_per_file': sum(r['reparses'] for r in results) / float(len(results))
+    }
+
+
+def run(filenames, repeat=1, per_rule=True):
+    """
+    Benchmark all given files with all rules enabled, and optionally with each
+    rule enabled on its own
+
+    :return: dict of results
+    """
+    all_rules = {name: True for name in rule_names}
+    results = bench_corpus(filenames, all_rules, repeat)
+
+    ret = {
+        'lintern_version': __version__,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'files': results,
+        'totals': totals(results),
+        'rules': {}
+    }
+
+    if per_rule:
+        for name in rule_names:
+            rule_results = bench_corpus(filenames, {name: True}, repeat)
+            ret['rules'][name] = {
+                'rewrite_time': sum(r['rewrite_time'] for r in rule_results),
+                'reparses_per_file': (sum(r['reparses'] for r in rule_results) /
+                                      float(len(rule_results)))
+            }
+
+    return ret
+
+
+def print_results(results):
+    print("%-24s %10s %10s %10s %10s %9s" % ("file", "bytes", "tokens", "parse ms",
+                                             "rewrite ms", "reparses"))
+    for r in results['files']:
+        print("%-24s %10d %10d %10.1f %10.1f %9d" % (r['file'], r['bytes'], r['tokens'],
+                                                     r['parse_time'] * 1000.0,
+                                                     r['rewrite_time'] * 1000.0,
+                                                     r['reparses']))
+
+    t = results['totals']
+    print("\n%d files, %d tokens in %.3f s: %.2f files/sec, %.0f tokens/sec, "
+          "%.2f reparses/file" % (t['files'], t['tokens'], t['time'], t['files_per_sec'],
+                                  t['tokens_per_sec'], t['reparses_per_file']))
+
+    if results['rules']:
+        print("\n%-32s %12s %16s" % ("rule (enabled on its own)", "rewrite ms", "reparses/file"))
+        for name in rule_names:
+            r = results['rules'][name]
+            print("%-32s %12.1f %16.2f" % (name, r['rewrite_time'] * 1000.0,
+                                           r['reparses_per_file']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--seed', default=0, type=int, dest='seed',
+                        help="Random seed for generating files")
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES), dest='sizes',
+                        help="Comma-separated list of file sizes to generate, e.g. 1K,5M. "
+                        "Default is %s." % ','.join(DEFAULT_SIZES))
+    parser.add_argument('--quick', action='store_const', const=','.join(QUICK_SIZES),
+                        dest='sizes', help="Only generate files of sizes %s, which "
+                        "leaves out the slowest files" % ','.join(QUICK_SIZES))
+    parser.add_argument('-r', '--repeat', default=1, type=int, dest='repeat',
+                        help="Number of times to rewrite each file. The fastest run "
+                        "is reported.")
+    parser.add_argument('-o', '--output', default=None, dest='output',
+                        help="Write results to this file as JSON")
+    parser.add_argument('--no-per-rule', action='store_false', dest='per_rule',
+                        help="Don't time each rule on its own")
+    parser.add_argument('--corpus-dir', default=None, dest='corpus_dir',
+                        help="Directory to generate files in. Default is a temporary "
+                        "directory, deleted afterwards.")
+    args = parser.parse_args()
+
+    sizes = args.sizes.split(',')
+
+    if args.corpus_dir is None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            results = run(generate_corpus(tmpdir, sizes, args.seed), args.repeat,
+                          args.per_rule)
+    else:
+        results = run(generate_corpus(args.corpus_dir, sizes, args.seed), args.repeat,
+                      args.per_rule)
+
+    results['seed'] = args.seed
+    print_results(results)
+
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,3 +3,20 @@ __license__ = "Apache 2.0"
 __version__ = "0.0.2"
 __maintainer__ = "Erik Nyquist"
 __email__ = "eknyquist@gmail.com"
+
+# Names from lintern.api that can be imported from lintern. They are only loaded
+# when first used, so that importing lintern (e.g. for __version__) doesn't need
+# libclang.
+_api_names = ['rewrite_text', 'rewrite_many', 'TextRewriter', 'RewriteResult']
+
+
+def __getattr__(name):
+    if name in _api_names:
+        from lintern import api
+        return getattr(api, name)
+
+    raise AttributeError("module 'lintern' has no attribute '%s'" % name)
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _api_names)
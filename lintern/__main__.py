@@ -2,26 +2,13 @@ import argparse
 import sys
 import os
 
-from lintern.rewriter import CodeRewriter, rewrite_rules
-from lintern.cfile import add_required_include_paths
+from lintern.config import get_default_config_data, verify_config_data
+from lintern.compdb import CompileCommands, COMPILE_COMMANDS_FILENAME
+from lintern.discover import DEFAULT_GLOBS, input_files
 
-import yaml
-
-
-def get_default_config_data():
-    return {r.__class__.__name__ : True for r in rewrite_rules}
-
-def verify_config_data(cfg_data):
-    default = get_default_config_data()
-
-    for key in cfg_data:
-        if key not in default:
-            return "unrecognised option '%s'" % key
-
-        if not isinstance(cfg_data[key], bool):
-            return "invalid value '%s' for option '%s'" % (str(cfg_data[key]), key)
-
-    return None
+# Note that yaml, and libclang along with everything else needed to rewrite
+# files, are only imported once they are needed, so that e.g. --help and
+# argument errors don't have to wait for them to load.
 
 
 def main():
@@ -35,6 +22,10 @@ def main():
     parser.add_argument('-i', '--in-place', action='store_true', dest='in_place',
                         help="Re-write files in place. Default behaviour is to print "
                         "modified files to stdout.")
+    parser.add_argument('--check', action='store_true', dest='check',
+                        help="Don't modify any files. Print a unified diff for each "
+                        "file that would be rewritten, and exit with a non-zero status "
+                        "if any file would be rewritten.")
     parser.add_argument('-g', '--generate-config', action='store_true', dest='gen_config',
                         help="Generate default configuration data, and print to stdout.")
     parser.add_argument('-e', '--ignore-errors', action='store_true', dest='ignore_errors',
@@ -43,18 +34,99 @@ def main():
                         "are encountered in a C file.")
     parser.add_argument('-d', '--add-include-dir', action='append', dest='include_dirs',
                         help="Add an extra include directory to pass to libclang")
-    parser.add_argument('filename', nargs='*')
+    parser.add_argument('--compiler', default='clang', dest='compiler',
+                        help="Compiler to find system include directories with. "
+                        "Default is 'clang'.")
+    parser.add_argument('-p', '--build-dir', default=None, dest='build_dir',
+                        help="Build directory containing a %s file. Files listed in "
+                        "it are parsed with the same compiler arguments that are used "
+                        "to build them." % COMPILE_COMMANDS_FILENAME)
+    parser.add_argument('--pch', action='store_true', dest='pch',
+                        help="Build a precompiled header for the headers that most input "
+                        "files start by including, and use it for parsing every file that "
+                        "does. The first few input files are read before any files are "
+                        "rewritten, to find out which headers they include.")
+    parser.add_argument('--pch-header', default=None, dest='pch_header', metavar='FILE',
+                        help="Build the precompiled header from this header (e.g. one "
+                        "which includes all the common headers of a project), and use "
+                        "it for parsing every file. Implies --pch.")
+    parser.add_argument('-j', '--jobs', default=1, type=int, dest='jobs',
+                        help="Number of worker processes to rewrite files with.")
+    parser.add_argument('--cache-dir', default=None, dest='cache_dir',
+                        help="Directory to cache rewrite results in. Files whose contents "
+                        "(and configuration) match a cached result are not parsed again.")
+    parser.add_argument('--cache-size', default=256, type=int, dest='cache_size',
+                        help="Maximum size of the cache directory in megabytes. Least "
+                        "recently used results are deleted when the cache is bigger "
+                        "than this.")
+    parser.add_argument('--stats', action='store_true', dest='stats',
+                        help="Print performance counters for each file and each rule "
+                        "to stderr when finished")
+    parser.add_argument('--stats-format', default='text', dest='stats_format',
+                        choices=['text', 'json'], help="Format to print --stats in")
+    parser.add_argument('--trace', default=None, dest='trace',
+                        help="Write a timeline of parsing, rule passes, edits and "
+                        "re-parses to this file, as Chrome trace events (can be "
+                        "viewed with chrome://tracing or ui.perfetto.dev)")
+    parser.add_argument('--serve', default=None, dest='serve', metavar='SOCKET',
+                        help="Run as a server, listening for files to rewrite on the "
+                        "given Unix socket. Keeps libclang and recently used files "
+                        "loaded between requests. Config file options are sent by "
+                        "the client with each request.")
+    parser.add_argument('--connect', default=None, dest='connect', metavar='SOCKET',
+                        help="Send files to be rewritten by a lintern server "
+                        "listening on the given Unix socket, instead of rewriting "
+                        "them in this process")
+    parser.add_argument('--watch', default=None, dest='watch', metavar='DIR',
+                        help="Watch a directory, and rewrite C files in it whenever "
+                        "they are saved, until interrupted")
+    parser.add_argument('--glob', action='append', default=[], dest='globs',
+                        metavar='PATTERN', help="Glob pattern for selecting files in "
+                        "directories given as input, and for --watch. Can be given more "
+                        "than once. Patterns starting with '!' exclude files (e.g. "
+                        "'!third_party/**'), and where several patterns match a file, "
+                        "the last one wins. Default is %s." % ', '.join(DEFAULT_GLOBS))
+    parser.add_argument('--files0-from', default=None, dest='files0_from', metavar='FILE',
+                        help="Also read input filenames from FILE ('-' for stdin), "
+                        "separated by NUL characters (e.g. from 'find -print0')")
+    parser.add_argument('filename', nargs='*', help="Files to rewrite. Directories are "
+                        "searched recursively, and '@FILE' reads filenames from FILE, "
+                        "one per line.")
     args = parser.parse_args()
 
     if args.gen_config:
+        import yaml
         print("\n" + yaml.dump(get_default_config_data()))
         return 0
 
-    if not args.filename:
+    if ((not args.filename) and (args.files0_from is None) and (args.serve is None)
+            and (args.watch is None)):
         print("Please provide one or more input filenames.")
         return 1
 
+    list_files = [f[1:] for f in args.filename if f.startswith('@')]
+    if args.files0_from not in [None, '-']:
+        list_files.append(args.files0_from)
+
+    for list_file in list_files:
+        if not os.path.isfile(list_file):
+            print("File list '%s' not found" % list_file)
+            return 1
+
+    if (args.pch_header is not None) and (not os.path.isfile(args.pch_header)):
+        print("Header '%s' not found" % args.pch_header)
+        return 1
+
+    if args.jobs < 1:
+        print("Invalid number of jobs '%d'" % args.jobs)
+        return 1
+
+    if (args.watch is not None) and (not os.path.isdir(args.watch)):
+        print("Directory '%s' not found" % args.watch)
+        return 1
+
     if os.path.isfile(args.config_file):
+        import yaml
         cfg_data = None
 
         try:
@@ -76,15 +148,78 @@ def main():
         print("configuration file '%s' not found, using default options." % args.config_file)
         cfg_data = get_default_config_data()
 
-    extra_dirs = [] if args.include_dirs is None else args.include_dirs
-    add_required_include_paths(extra_include_paths=extra_dirs)
+    # Files are found as they are needed, so that the first files can be
+    # rewritten while directories are still being searched
+    filenames = input_files(args.filename, args.globs, args.files0_from)
+
+    if args.connect is not None:
+        from lintern.client import rewrite_with_server
+        return rewrite_with_server(args, cfg_data, filenames=filenames)
 
-    r = CodeRewriter(args, cfg_data)
-    if r.files is None:
+    compile_commands = None
+    if args.build_dir is not None:
+        try:
+            compile_commands = CompileCommands(args.build_dir)
+        except (IOError, ValueError) as e:
+            print("Unable to read %s from '%s': %s" % (COMPILE_COMMANDS_FILENAME,
+                                                       args.build_dir, e))
+            return 1
+
+    from lintern.cfile import include_path_args
+    from lintern.rewriter import CodeRewriter, rewrite_parallel
+
+    extra_dirs = [] if args.include_dirs is None else args.include_dirs
+    try:
+        include_args = include_path_args(extra_include_paths=extra_dirs,
+                                         compiler_path=args.compiler)
+    except (OSError, ValueError) as e:
+        print("Unable to find system include directories with compiler '%s': %s"
+              % (args.compiler, e))
         return 1
 
-    r.rewrite()
-    return 0
+    if args.serve is not None:
+        from lintern.server import LinternServer
+
+        server = LinternServer(args.serve, args, include_args=include_args,
+                               compile_commands=compile_commands)
+        try:
+            server.serve_forever()
+        except OSError as e:
+            print("Unable to start lintern server on '%s': %s" % (args.serve, e))
+            return 1
+        except KeyboardInterrupt:
+            pass
+
+        return 0
+
+    if args.watch is not None:
+        from lintern.watch import WatchRewriter
+
+        try:
+            WatchRewriter(args, cfg_data, include_args=include_args,
+                          compile_commands=compile_commands).watch(args.watch)
+        except KeyboardInterrupt:
+            pass
+
+        return 0
+
+    if args.jobs > 1:
+        return rewrite_parallel(args, cfg_data, args.jobs, filenames=filenames,
+                                include_args=include_args,
+                                compile_commands=compile_commands)
+
+    r = CodeRewriter(args, cfg_data, filenames=filenames, include_args=include_args,
+                     compile_commands=compile_commands)
+    num_changed = r.rewrite()
+    r.finish()
+
+    if args.check:
+        from lintern.output import check_summary
+        sys.stderr.write(check_summary(num_changed) + "\n")
+        if num_changed:
+            return 1
+
+    return 1 if r.failed else 0
 
 if __name__ == "__main__":
     sys.exit(main())
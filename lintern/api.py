@@ -0,0 +1,184 @@
+import argparse
+
+import clang.cindex
+from clang.cindex import TranslationUnitLoadError
+
+from lintern.config import get_default_config_data, verify_config_data
+from lintern.cfile import CFile, include_path_args, default_compiler_args
+from lintern.rewriter import CodeRewriter
+
+
+# Name that code is parsed as, when no filename is given. libclang only uses it
+# to decide which language the code is in, and to find headers included with
+# quotes (relative to the current directory, in this case).
+DEFAULT_FILENAME = 'input.c'
+
+
+class RewriteResult(object):
+    """
+    Result of rewriting some C code with a TextRewriter
+
+    :ivar str filename: name the code was parsed as
+    :ivar str text: original code
+    :ivar str new_text: rewritten code, or None if the code could not be rewritten
+    :ivar list errors: error messages from libclang for the original code. If \
+        there are any, the code could not be rewritten, unless errors were \
+        being ignored.
+    :ivar list warnings: warning messages from libclang for the original code, \
+        whether or not it could be rewritten
+    """
+    def __init__(self, filename, text, new_text, errors=None, warnings=None):
+        self.filename = filename
+        self.text = text
+        self.new_text = new_text
+        self.errors = [] if errors is None else errors
+        self.warnings = [] if warnings is None else warnings
+
+    @property
+    def changed(self):
+        """
+        True if the code was rewritten, and anything in it changed
+        """
+        return (self.new_text is not None) and (self.new_text != self.text)
+
+
+class TextRewriter(object):
+    """
+    Rewrites C code held in strings, without reading or writing any files (apart
+    from headers included by the code) or printing anything. The libclang index,
+    the enabled rules and the compiler arguments are set up once, and used for
+    every call to rewrite() and rewrite_many().
+
+    :param dict config: configuration data, in the same form as the contents \
+        of a .lintern file (default is all rules enabled)
+    :param str indent_type: 'space' or 'tab'
+    :param int indent_level: number of indent characters per indent level
+    :param list compiler_args: arguments to parse code with. Default is \
+        '-std=c99', plus the system include directories of 'compiler'.
+    :param str compiler: compiler to find system include directories with
+    :param bool ignore_errors: rewrite code even if it has parse errors
+
+    :raises ValueError: if the configuration or indent type is not valid, or \
+        the system include directories could not be found
+    :raises OSError: if the compiler could not be run
+    """
+    def __init__(self, config=None, indent_type='space', indent_level=4, compiler_args=None,
+                 compiler='clang', ignore_errors=False):
+        if config is None:
+            config = get_default_config_data()
+
+        result = verify_config_data(config)
+        if result is not None:
+            raise ValueError("Invalid configuration: %s" % result)
+
+        if indent_type not in ['space', 'tab']:
+            raise ValueError("Invalid indent type '%s'" % indent_type)
+
+        if compiler_args is None:
+            compiler_args = default_compiler_args + include_path_args(compiler_path=compiler)
+
+        self.compiler_args = compiler_args
+
+        # Only the options that CodeRewriter and the rules look at
+        args = argparse.Namespace(indent_type=indent_type, indent_level=int(indent_level),
+                                  ignore_errors=ignore_errors, check=False, in_place=False,
+                                  cache_dir=None, stats=False, trace=None, filename=[],
+                                  pch=False, pch_header=None)
+
+        self.rewriter = CodeRewriter(args, config, filenames=[])
+        self.rewriter.index = clang.cindex.Index.create()
+
+    def rewrite(self, text, filename=None):
+        """
+        Rewrite some C code
+
+        :param str text: code to rewrite
+        :param str filename: name to parse the code as (default is DEFAULT_FILENAME)
+
+        :return: RewriteResult
+        """
+        if filename is None:
+            filename = DEFAULT_FILENAME
+
+        try:
+            cf = CFile(filename, ignore_errors=self.rewriter.config.ignore_errors,
+                       index=self.rewriter.index, text=text, args=self.compiler_args)
+        except TranslationUnitLoadError as e:
+            return RewriteResult(filename, text, None, [str(e)])
+
+        # Diagnostics for the original code, before it is re-parsed
+        errors = cf.errors
+        warnings = cf.warnings
+
+        if cf.parsed is None:
+            return RewriteResult(filename, text, None, errors, warnings)
+
+        new_text = self.rewriter._rewrite_file(cf)
+        if new_text is None:
+            # The rewritten code had errors
+            return RewriteResult(filename, text, None, cf.errors, warnings)
+
+        return RewriteResult(filename, text, new_text, errors, warnings)
+
+    def rewrite_many(self, items):
+        """
+        Rewrite a batch of C code, one at a time, as they are generated
+
+        :param items: iterable of (filename, text) tuples. filename may be None.
+
+        :return: generator of RewriteResult, in the same order as 'items'
+        """
+        for filename, text in items:
+            yield self.rewrite(text, filename)
+
+
+# TextRewriter instances used by rewrite_text and rewrite_many, keyed by options
+_rewriters = {}
+
+
+def _text_rewriter(config, indent_type, indent_level):
+    if config is None:
+        config = get_default_config_data()
+
+    key = (tuple(sorted(config.items())), indent_type, indent_level)
+
+    ret = _rewriters.get(key)
+    if ret is None:
+        ret = TextRewriter(config, indent_type=indent_type, indent_level=indent_level)
+        _rewriters[key] = ret
+
+    return ret
+
+
+def rewrite_text(text, config=None, filename=None, indent_type='space', indent_level=4):
+    """
+    Rewrite some C code, with the default compiler arguments. The same
+    TextRewriter (and so the same libclang index and rules) is used for every
+    call with the same options; use TextRewriter directly for more control.
+
+    :param str text: code to rewrite
+    :param dict config: configuration data, in the same form as the contents \
+        of a .lintern file (default is all rules enabled)
+    :param str filename: name to parse the code as
+    :param str indent_type: 'space' or 'tab'
+    :param int indent_level: number of indent characters per indent level
+
+    :return: RewriteResult
+    """
+    return _text_rewriter(config, indent_type, indent_level).rewrite(text, filename)
+
+
+def rewrite_many(items, config=None, indent_type='space', indent_level=4):
+    """
+    Rewrite a batch of C code, with the default compiler arguments (see
+    rewrite_text)
+
+    :param items: iterable of (filename, text) tuples. filename may be None.
+    :param dict config: configuration data, in the same form as the contents \
+        of a .lintern file (default is all rules enabled)
+    :param str indent_type: 'space' or 'tab'
+    :param int indent_level: number of indent characters per indent level
+
+    :return: generator of RewriteResult, in the same order as 'items'
+    """
+    return _text_rewriter(config, indent_type, indent_level).rewrite_many(items)
@@ -0,0 +1,142 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from lintern import __version__
+
+
+class ResultCache(object):
+    """
+    Content-addressed on-disk cache of rewrite results, so that unchanged files
+    do not need to be parsed again. Entries are keyed by a hash of the file
+    contents, combined with everything else that can change the result (enabled
+    rules, indent options, whether parse errors are ignored, the file's compiler
+    arguments and the lintern version). Each entry records either that the file needed no changes, or the
+    rewritten file.
+
+    Entries are written to a temporary file and then renamed into place, so
+    multiple lintern processes can safely share one cache directory. Reading an
+    entry bumps its modification time, and prune() deletes the least recently
+    used entries until the cache is no bigger than max_size bytes.
+    """
+    ENTRY_UNCHANGED = b'='
+    ENTRY_REWRITTEN = b'+'
+
+    def __init__(self, cache_dir, max_size, rule_names, config):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        key_data = {
+            'version': __version__,
+            'rules': sorted(rule_names),
+            'indent_type': config.indent_type,
+            'indent_level': str(config.indent_level),
+
+            # Files with parse errors are only rewritten (and their results
+            # cached) with -e, so a result cached with -e must not be used
+            # without it
+            'ignore_errors': bool(config.ignore_errors)
+        }
+
+        self._key_prefix = json.dumps(key_data, sort_keys=True).encode('utf-8')
+
+    def _entry_path(self, text, compiler_args):
+        h = hashlib.sha256(self._key_prefix)
+        h.update(b'\0')
+        h.update(json.dumps([str(a) for a in compiler_args]).encode('utf-8'))
+        h.update(b'\0')
+        h.update(text.encode('utf-8', 'surrogateescape'))
+        digest = h.hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest[2:])
+
+    def get(self, text, compiler_args):
+        """
+        Returns the cached result of rewriting the given file contents with the
+        given compiler arguments, or None if there is no cached result
+        """
+        path = self._entry_path(text, compiler_args)
+
+        try:
+            with open(path, 'rb') as fh:
+                data = fh.read()
+
+            # Mark as recently used
+            os.utime(path, None)
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        if data[:1] == self.ENTRY_UNCHANGED:
+            return text
+
+        return data[1:].decode('utf-8', 'surrogateescape')
+
+    def put(self, text, compiler_args, new_text):
+        path = self._entry_path(text, compiler_args)
+
+        if new_text == text:
+            data = self.ENTRY_UNCHANGED
+        else:
+            data = self.ENTRY_REWRITTEN + new_text.encode('utf-8', 'surrogateescape')
+
+        try:
+            entry_dir = os.path.dirname(path)
+            os.makedirs(entry_dir, exist_ok=True)
+
+            fd, tmppath = tempfile.mkstemp(dir=entry_dir, prefix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as fh:
+                    fh.write(data)
+
+                os.replace(tmppath, path)
+            except OSError:
+                os.unlink(tmppath)
+                raise
+        except OSError:
+            # Failing to write a cache entry is not fatal
+            pass
+
+    def prune(self):
+        """
+        Delete least recently used entries until the total size of all entries
+        is no bigger than max_size
+        """
+        entries = []
+        total_size = 0
+
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                if name.startswith('.tmp'):
+                    continue
+
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # Deleted by another process
+                    continue
+
+                entries.append((st.st_mtime, st.st_size, path))
+                total_size += st.st_size
+
+        if total_size <= self.max_size:
+            return
+
+        entries.sort()
+        for mtime, size, path in entries:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+            total_size -= size
+            if total_size <= self.max_size:
+                break
+
+    def summary(self):
+        return "cache: %d hits, %d misses" % (self.hits, self.misses)
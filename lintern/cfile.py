@@ -1,16 +1,34 @@
+import re
+import time
+import bisect
+import itertools
+from collections import OrderedDict
+from array import array
+from ctypes import POINTER, byref, c_uint, cast
+
 import clang.cindex
-from clang.cindex import TokenKind, Diagnostic
+from clang.cindex import (
+        TokenKind, CursorKind, Diagnostic, TranslationUnit, Token, Cursor, SourceLocation,
+        SourceRange, conf
+)
 
-import ccsyspath
+from lintern.syspaths import system_include_paths
 
-compiler_args = ['-std=c99']
+default_compiler_args = ['-std=c99']
 
 
-def add_required_include_paths(extra_include_paths=[], compiler_path='clang'):
-    include_paths = ccsyspath.system_include_paths('clang') + extra_include_paths
+def include_path_args(extra_include_paths=[], compiler_path='clang'):
+    """
+    Returns libclang arguments to add the compiler's system include directories,
+    followed by any extra include directories
+    """
+    ret = []
+    include_paths = system_include_paths(compiler_path) + extra_include_paths
 
     for p in include_paths:
-        compiler_args.extend(['-I', p])
+        ret.extend(['-I', p])
+
+    return ret
 
 
 class CodeChunkReplacement(object):
@@ -20,8 +38,757 @@ class CodeChunkReplacement(object):
         self.end = end_file_offset
         self.replacement_text = replacement_text
 
+    def span(self):
+        # Some rules insert text by using an end offset that comes before the
+        # start offset, so normalize here for overlap checks
+        return min(self.start, self.end), max(self.start, self.end)
+
+    def same_edit(self, other):
+        return ((self.start == other.start) and (self.end == other.end) and
+                (self.replacement_text == other.replacement_text))
+
+
+class ReplacementBatch(object):
+    """
+    Collects non-overlapping CodeChunkReplacements generated against a single
+    version of a file, so that they can all be applied together (see
+    TextBuffer.replace) with one re-parse. When two replacements overlap, the one with the lower priority
+    value (i.e. from the rule that comes first in the list of rules) is kept,
+    and the other is dropped and counted as a conflict; the caller is expected
+    to run another pass over the re-parsed file to pick those up.
+
+    Rules are applied as if each one ran over the whole file in turn, seeing
+    the changes made by the rules before it, but not those made by the rules
+    after it (see defer_later_rules).
+
+    :param int first_priority: replacements with a lower priority value than \
+        this (i.e. from rules that have already finished) are ignored
+    """
+    def __init__(self, first_priority=0):
+        self.replacements = []
+        self.priorities = []
+        self.starts = []
+        self.conflicts = 0
+        self.first_priority = first_priority
+
+        # Spans of replacements that were dropped because of a conflict, and
+        # the lowest priority value of any of them
+        self.dropped = []
+        self.first_conflict = None
+
+    def _overlapping(self, lo, hi, i):
+        ret = []
+
+        if i > 0:
+            olo, ohi = self.replacements[i - 1].span()
+            if lo < ohi:
+                ret.append(i - 1)
+
+        while i < len(self.replacements):
+            olo = self.starts[i]
+            if (olo != lo) and (olo >= hi):
+                break
+
+            ret.append(i)
+            i += 1
+
+        return ret
+
+    def _drop(self, span, priority):
+        self.dropped.append(span)
+        if (self.first_conflict is None) or (priority < self.first_conflict):
+            self.first_conflict = priority
+
+    def add(self, rep, priority=0):
+        if priority < self.first_priority:
+            return False
+
+        lo, hi = rep.span()
+        i = bisect.bisect_left(self.starts, lo)
+        overlapping = self._overlapping(lo, hi, i)
+
+        for j in overlapping:
+            if rep.same_edit(self.replacements[j]):
+                # Same edit generated again from a different token, nothing to do
+                return True
+
+        if overlapping:
+            self.conflicts += 1
+
+            for j in overlapping:
+                if self.priorities[j] <= priority:
+                    self._drop((lo, hi), priority)
+                    return False
+
+            # All overlapping replacements came from rules with a lower
+            # priority, so drop them in favour of this one
+            for j in reversed(overlapping):
+                self._drop(self.replacements[j].span(), self.priorities[j])
+                del self.replacements[j]
+                del self.priorities[j]
+                del self.starts[j]
+
+            i = overlapping[0]
+
+        self.replacements.insert(i, rep)
+        self.priorities.insert(i, priority)
+        self.starts.insert(i, lo)
+        return True
+
+    def defer_later_rules(self):
+        """
+        If any replacements were dropped because of a conflict, the rule they
+        came from has not finished with the file, so the rules after it should
+        not have seen it yet. Drops the replacements from those rules too, to
+        be generated again by the next pass, which should start from that rule
+        (see first_conflict); the rules before it have finished.
+        """
+        if self.first_conflict is None:
+            return
+
+        for j in reversed(range(len(self.replacements))):
+            if self.priorities[j] > self.first_conflict:
+                self.dropped.append(self.replacements[j].span())
+                del self.replacements[j]
+                del self.priorities[j]
+                del self.starts[j]
+
+    def edited_spans(self):
+        """
+        Returns the spans of the file which were changed by the replacements, or
+        would have been changed by the ones that were dropped, as a sorted list
+        of non-overlapping (old start, old end, new start, new end) tuples of
+        offsets into the contents before and after the replacements are applied.
+        Everything outside these spans is the same as it was before the
+        replacements were applied, just shifted.
+        """
+        # Spans in the contents before the replacements are applied, along with
+        # the change in length made by each one (None for dropped replacements)
+        spans = [(lo, hi, len(rep.replacement_text) - (rep.end - rep.start))
+                 for rep, (lo, hi) in ((r, r.span()) for r in self.replacements)]
+        spans.extend((lo, hi, None) for lo, hi in self.dropped)
+        spans.sort(key=lambda s: s[:2])
+
+        ret = []
+        shift = 0
+        group_lo = group_hi = group_delta = None
+
+        for lo, hi, delta in spans:
+            if (group_lo is not None) and (lo > group_hi):
+                ret.append((group_lo, group_hi, group_lo + shift,
+                            group_hi + shift + group_delta))
+                shift += group_delta
+                group_lo = None
+
+            if group_lo is None:
+                group_lo, group_hi, group_delta = lo, hi, 0
+            else:
+                group_hi = max(group_hi, hi)
+
+            if delta is not None:
+                group_delta += delta
+
+        if group_lo is not None:
+            ret.append((group_lo, group_hi, group_lo + shift, group_hi + shift + group_delta))
+
+        return ret
+
+
+class TextBuffer(object):
+    """
+    Piece table holding the contents of a file while it is being rewritten.
+    Applying replacements only changes the list of pieces (each one a slice of
+    the original contents, or of a replacement's text), without copying the
+    contents; they are only joined into a single string when they are asked for,
+    i.e. when the file is re-parsed (libclang needs the whole file) or the
+    result is written out.
+    """
+    __slots__ = ('pieces', '_text')
+
+    def __init__(self, text):
+        # List of (string, start, end) tuples
+        self.pieces = [(text, 0, len(text))] if text else []
+        self._text = text
+
+    def __len__(self):
+        return sum(end - start for _, start, end in self.pieces)
+
+    @property
+    def text(self):
+        """
+        The current contents, as a single string
+        """
+        if self._text is None:
+            self._text = ''.join([s if (start == 0) and (end == len(s)) else s[start:end]
+                                  for s, start, end in self.pieces])
+
+        return self._text
+
+    def _slice(self, piece_starts, lo, hi):
+        # Returns the pieces covering the range [lo, hi) of the current contents,
+        # given the offset of the start of each piece
+        ret = []
+        if lo >= hi:
+            return ret
+
+        i = max(0, bisect.bisect_right(piece_starts, lo) - 1)
+        while (i < len(self.pieces)) and (piece_starts[i] < hi):
+            s, start, end = self.pieces[i]
+            offset = piece_starts[i]
+
+            start, end = max(start, start + (lo - offset)), min(end, start + (hi - offset))
+            if start < end:
+                ret.append((s, start, end))
+
+            i += 1
+
+        return ret
+
+    def replace(self, replacements):
+        """
+        Apply CodeChunkReplacements to the current contents, e.g. all of the
+        replacements in a ReplacementBatch. Replacements must be sorted by
+        offset, and must not overlap. As with slicing a string, a replacement
+        whose end offset comes before its start offset inserts its text, and
+        then repeats the text between the two offsets.
+        """
+        if not replacements:
+            return
+
+        piece_starts = []
+        offset = 0
+        for _, start, end in self.pieces:
+            piece_starts.append(offset)
+            offset += end - start
+
+        pieces = []
+        pos = 0
+
+        for rep in replacements:
+            pieces.extend(self._slice(piece_starts, pos, rep.start))
+            if rep.replacement_text:
+                pieces.append((rep.replacement_text, 0, len(rep.replacement_text)))
+
+            pos = rep.end
+
+        pieces.extend(self._slice(piece_starts, pos, offset))
+
+        self.pieces = pieces
+        self._text = None
+
+
+def _location_offset(location):
+    offset = c_uint()
+    conf.lib.clang_getInstantiationLocation(location, None, None, None, byref(offset))
+    return offset.value
+
+
+class BracketIndex(object):
+    """
+    Tables for finding matching brackets and statement boundaries in a
+    TokenSnapshot, without scanning through the tokens. The bracket depth at
+    every bracket and ';' token is computed in one go, and the positions of
+    each closing bracket and each ';' are grouped by depth, so that e.g. the
+    next ';' at the same depth as a token is found with a binary search. Built
+    once for each TokenSnapshot, see TokenSnapshot.brackets.
+    """
+    __slots__ = ('_positions', '_depths', '_closing', '_semicolons', '_boundaries')
+
+    PAIRS = ('()', '{}')
+
+    def __init__(self, tokens):
+        ids = {}
+        for spelling in '(){};':
+            if spelling in tokens.spellings:
+                ids[tokens.spellings.index(spelling)] = spelling
+
+        # Positions and spellings of the tokens with any of the spellings above
+        self._positions = [i for i, s in enumerate(tokens.spelling_ids) if s in ids]
+        spellings = [ids[tokens.spelling_ids[i]] for i in self._positions]
+
+        # Depth of each kind of bracket before each of those tokens (and after
+        # the last one), and positions of closing brackets grouped by the depth
+        # that they close back to
+        self._depths = {}
+        self._closing = {}
+        for opening, closing in self.PAIRS:
+            depths = array('i', [0])
+            depths.extend(itertools.accumulate(1 if s == opening else -1 if s == closing else 0
+                                               for s in spellings))
+            self._depths[opening] = depths
+
+            self._closing[opening] = closers = {}
+            for k in range(len(spellings)):
+                if spellings[k] == closing:
+                    closers.setdefault(depths[k + 1], []).append(self._positions[k])
+
+        # ';' positions, grouped by parenthesis depth
+        self._semicolons = {}
+        depths = self._depths['(']
+        for k in range(len(spellings)):
+            if spellings[k] == ';':
+                self._semicolons.setdefault(depths[k], []).append(self._positions[k])
+
+        # Tokens which end a statement, or a run of statements, when looking
+        # backwards from a token: comments, and '{', '}' and ';'
+        boundaries = [self._positions[k] for k in range(len(spellings)) if spellings[k] in '{};']
+        comment = TokenKind.COMMENT.value
+        boundaries.extend([i for i, k in enumerate(tokens.kinds) if k == comment])
+        self._boundaries = sorted(boundaries)
+
+    def _depth(self, index, opening):
+        # Bracket depth before the given token
+        return self._depths[opening][bisect.bisect_left(self._positions, index)]
+
+    @staticmethod
+    def _next(positions, index, end):
+        if positions is None:
+            return None
+
+        i = bisect.bisect_left(positions, index)
+        if (i < len(positions)) and (positions[i] < end):
+            return positions[i]
+
+        return None
+
+    def matching_close(self, start, end, opening='('):
+        """
+        Returns the index of the first closing bracket at or after 'start' (and
+        before 'end') which brings the bracket depth back to what it was at
+        'start', i.e. the partner of the first opening bracket after 'start',
+        or None
+        """
+        depth = self._depth(start, opening)
+        return self._next(self._closing[opening].get(depth), start, end)
+
+    def next_toplevel_semicolon(self, index, end):
+        """
+        Returns the index of the first ';' at or after 'index' (and before
+        'end') which is at the same parenthesis depth as 'index', or None
+        """
+        return self._next(self._semicolons.get(self._depth(index, '(')), index, end)
+
+    def statement_start(self, index):
+        """
+        Returns the index of the token after the last comment, '{', '}' or ';'
+        before 'index' (not counting the first token), or 'index' itself if
+        there isn't one
+        """
+        i = bisect.bisect_left(self._boundaries, index) - 1
+        if (i < 0) or (self._boundaries[i] == 0):
+            return index
+
+        return self._boundaries[i] + 1
+
+
+class TokenSnapshot(object):
+    """
+    Compact, read-only snapshot of all the tokens in a parsed file. Reading the
+    kind, spelling, extent or cursor of a clang.cindex.Token is a ctypes call
+    every time (and Token.cursor annotates one token at a time), so instead all
+    tokens are annotated with a single call to clang_annotateTokens, and
+    everything the rules need is read once and stored in parallel arrays,
+    indexed by token number. Cursors are only turned into Cursor objects when
+    they are asked for.
+    """
+    __slots__ = ('tu', 'kinds', 'spelling_ids', 'spellings', 'starts', 'ends',
+                 'cursor_kinds', '_spelling_index', '_cursor_chunks', '_brackets')
+
+    def __init__(self, tu, extent=None):
+        self.tu = tu
+        self.kinds = array('i')
+        self.spelling_ids = array('i')
+        self.spellings = []
+        self.starts = array('q')
+        self.ends = array('q')
+        self.cursor_kinds = array('i')
+        self._spelling_index = {}
+
+        # List of (first token index, last token index + 1, array of cursors,
+        # offset into array) for each run of tokens that was annotated together
+        self._cursor_chunks = []
+        self._brackets = None
+
+        if extent is not None:
+            self._add_tokens(extent)
+
+    def _add_tokens(self, extent, lo=0, hi=None):
+        # Appends the tokens in the given extent, leaving out any that start
+        # outside of the offsets [lo, hi)
+        tu = self.tu
+        tokens_memory = POINTER(Token)()
+        tokens_count = c_uint()
+        conf.lib.clang_tokenize(tu, extent, byref(tokens_memory), byref(tokens_count))
+
+        count = int(tokens_count.value)
+        if count < 1:
+            return
+
+        try:
+            cursors = (Cursor * count)()
+            conf.lib.clang_annotateTokens(tu, tokens_memory, count, cursors)
+
+            tokens = cast(tokens_memory, POINTER(Token * count)).contents
+            spelling_index = self._spelling_index
+            first = None
+            first_index = len(self.kinds)
+
+            for i in range(count):
+                tok = tokens[i]
+                extent = conf.lib.clang_getTokenExtent(tu, tok)
+                start = _location_offset(conf.lib.clang_getRangeStart(extent))
+                if (start < lo) or ((hi is not None) and (start >= hi)):
+                    continue
+
+                if first is None:
+                    first = i
+
+                spelling = conf.lib.clang_getTokenSpelling(tu, tok)
+                spelling_id = spelling_index.get(spelling)
+                if spelling_id is None:
+                    spelling_id = len(self.spellings)
+                    spelling_index[spelling] = spelling_id
+                    self.spellings.append(spelling)
+
+                self.kinds.append(conf.lib.clang_getTokenKind(tok))
+                self.spelling_ids.append(spelling_id)
+                self.starts.append(start)
+                self.ends.append(_location_offset(conf.lib.clang_getRangeEnd(extent)))
+                self.cursor_kinds.append(cursors[i]._kind_id)
+        finally:
+            conf.lib.clang_disposeTokens(tu, tokens_memory, count)
+
+        if first is not None:
+            self._cursor_chunks.append((first_index, len(self.kinds), cursors, first))
+
+    def _add_shifted(self, other, start, end, shift):
+        # Appends tokens [start, end) of another snapshot, with their offsets
+        # moved by the given amount. Cursors are not copied, since they belong
+        # to the translation unit as it was before it was re-parsed.
+        self.kinds.extend(other.kinds[start:end])
+        self.cursor_kinds.extend(other.cursor_kinds[start:end])
+        self.spelling_ids.extend(other.spelling_ids[start:end])
+
+        if shift == 0:
+            self.starts.extend(other.starts[start:end])
+            self.ends.extend(other.ends[start:end])
+        else:
+            self.starts.extend([s + shift for s in other.starts[start:end]])
+            self.ends.extend([e + shift for e in other.ends[start:end]])
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def kind(self, index):
+        return TokenKind.from_value(self.kinds[index])
+
+    def spelling(self, index):
+        return self.spellings[self.spelling_ids[index]]
+
+    def start(self, index):
+        return self.starts[index]
+
+    def end(self, index):
+        return self.ends[index]
+
+    def cursor_kind(self, index):
+        return CursorKind.from_id(self.cursor_kinds[index])
+
+    def cursor(self, index):
+        """
+        Returns the cursor for a token, or None if the token was carried over
+        from before the file was last re-parsed (see updated())
+        """
+        chunk = bisect.bisect_right(self._cursor_chunks, (index + 1, )) - 1
+        if chunk < 0:
+            return None
+
+        first, end, cursors, offset = self._cursor_chunks[chunk]
+        if index >= end:
+            return None
+
+        cursor = cursors[index - first + offset]
+        cursor._tu = self.tu
+        return cursor
+
+    @property
+    def brackets(self):
+        """
+        BracketIndex for these tokens, built when first needed
+        """
+        if self._brackets is None:
+            self._brackets = BracketIndex(self)
+
+        return self._brackets
+
+    def is_punctuation(self, index, spelling):
+        return ((self.kinds[index] == TokenKind.PUNCTUATION.value) and
+                (self.spelling(index) == spelling))
+
+    def is_keyword(self, index, spelling):
+        return ((self.kinds[index] == TokenKind.KEYWORD.value) and
+                (self.spelling(index) == spelling))
+
+    def toplevel_starts(self):
+        """
+        Returns the index of the first token of each top-level region of the
+        file (i.e. declarations and function definitions), found from the
+        tokens alone. A region ends after each ';' or '}' that is not inside
+        any braces or parentheses.
+        """
+        ids = {}
+        for spelling in ['(', ')', '{', '}', ';']:
+            if spelling in self.spellings:
+                ids[self.spellings.index(spelling)] = spelling
+
+        ret = array('q', [0])
+        depth = 0
+
+        for i in range(len(self.spelling_ids)):
+            spelling = ids.get(self.spelling_ids[i])
+            if spelling is None:
+                continue
+
+            if spelling in '({':
+                depth += 1
+            elif spelling in ')}':
+                depth -= 1
+
+            if (depth <= 0) and (spelling in ';}'):
+                depth = 0
+                if (i + 1) < len(self.spelling_ids):
+                    ret.append(i + 1)
+
+        return ret
+
+    def dirty_ranges(self, spans):
+        """
+        Returns the top-level regions (see toplevel_starts) that contain any of
+        the given spans, as sorted, non-overlapping (start, end) ranges of token
+        indices
+
+        :param list spans: sorted list of (start, end) offsets
+        """
+        region_starts = self.toplevel_starts()
+        ret = []
+
+        for lo, hi in spans:
+            first = max(0, bisect.bisect_right(self.starts, lo) - 1)
+            last = min(len(self) - 1, bisect.bisect_left(self.starts, hi))
+
+            region = bisect.bisect_right(region_starts, first) - 1
+            start = region_starts[region]
+
+            region = bisect.bisect_right(region_starts, last)
+            end = region_starts[region] if region < len(region_starts) else len(self)
+
+            if ret and (start <= ret[-1][1]):
+                ret[-1] = (ret[-1][0], max(end, ret[-1][1]))
+            else:
+                ret.append((start, end))
+
+        return ret
+
+    def updated(self, edited_spans, length):
+        """
+        Returns a TokenSnapshot of the translation unit after it has been
+        re-parsed with edits made, without tokenizing the whole file again. The
+        top-level regions which contain the edits are tokenized again, and the
+        tokens of all other regions are carried over with their offsets shifted.
+        Carried-over tokens have no cursors (see cursor()).
+
+        :param list edited_spans: spans of the edits, from \
+            ReplacementBatch.edited_spans
+        :param int length: length of the file after the edits
+
+        :return: tuple of the form (snapshot, ranges), where 'ranges' is a list \
+            of (start, end) token indices of the regions that were tokenized again
+        """
+        ret = TokenSnapshot(self.tu)
+        ret.spellings = list(self.spellings)
+        ret._spelling_index = dict(self._spelling_index)
+        ranges = []
+
+        main_file = self.tu.get_file(self.tu.spelling)
+        span = 0
+        shift = 0
+
+        def new_offset(offset):
+            # Offsets passed in here must be increasing, and outside the spans
+            nonlocal span, shift
+            while (span < len(edited_spans)) and (edited_spans[span][0] < offset):
+                shift = edited_spans[span][3] - edited_spans[span][1]
+                span += 1
+
+            return offset + shift
+
+        prev = 0
+        for start, end in self.dirty_ranges([s[:2] for s in edited_spans]):
+            if prev < start:
+                ret._add_shifted(self, prev, start, new_offset(self.starts[prev]) - self.starts[prev])
+
+            lo = new_offset(self.starts[start])
+            hi = length if end >= len(self) else new_offset(self.starts[end])
+            extent = SourceRange.from_locations(SourceLocation.from_offset(self.tu, main_file, lo),
+                                                SourceLocation.from_offset(self.tu, main_file, hi))
+
+            first = len(ret)
+            ret._add_tokens(extent, lo, hi)
+            ranges.append((first, len(ret)))
+            prev = end
+
+        if prev < len(self):
+            ret._add_shifted(self, prev, len(self), new_offset(self.starts[prev]) - self.starts[prev])
+
+        return ret, ranges
+
+
+class LineIndex(object):
+    """
+    Start offset of every line in a file's contents, so that the indentation of
+    the line containing an offset can be found with a binary search, instead of
+    by scanning backwards through the text. Built once for each version of the
+    contents, see CFile.lines.
+    """
+    __slots__ = ('text', 'starts')
+
+    INDENT = re.compile(r'[ \t\v]*')
+
+    def __init__(self, text):
+        self.text = text
+        self.starts = array('q', [0])
+        self.starts.extend(m.end() for m in re.finditer('\n', text))
+
+    def indent(self, offset):
+        """
+        Returns the whitespace at the start of the line containing the given
+        offset, up to (and including) the offset itself, or an empty string if
+        the offset is at the end of a line
+        """
+        if (offset >= len(self.text)) or (self.text[offset] == '\n'):
+            return ''
+
+        start = self.starts[bisect.bisect_right(self.starts, offset) - 1]
+        return self.INDENT.match(self.text, start, offset + 1).group()
+
+
+class IndexedCursor(object):
+    __slots__ = ('cursor', 'kind', 'start', 'end')
+
+    def __init__(self, cursor, kind, start, end):
+        self.cursor = cursor
+        self.kind = kind
+        self.start = start
+        self.end = end
+
+
+class CursorIndex(object):
+    """
+    Index of cursors in the main file of a parsed translation unit, built with a
+    single walk of the AST. Maps each of the requested cursor kinds to the
+    cursors of that kind (as IndexedCursor objects, in the order they appear in
+    the file), along with the range of token indices (as start, end+1) each
+    cursor covers in the given TokenSnapshot.
+
+    Only cursors whose location is in the main file and which start exactly on
+    a token are indexed, which leaves out statements generated by macro expansions.
+    If a list of (start, end) token index ranges is given, only the top-level
+    cursors which overlap those ranges are walked.
+
+    If parameter_uses is True, the walk also counts the DECL_REF_EXPR cursors
+    that refer to each function parameter (see uses()).
+    """
+    def __init__(self, tu, tokens, kinds, ranges=None, parameter_uses=False):
+        self.by_kind = {k: [] for k in kinds}
+        self.by_start = {}
+
+        # Number of references to each PARM_DECL cursor
+        self.parameter_uses = {}
+
+        kinds_by_id = {k.value: k for k in kinds}
+        if (not kinds_by_id) or (not tokens):
+            return
+
+        stack = [c for c in tu.cursor.get_children()
+                 if conf.lib.clang_Location_isFromMainFile(c.location)]
+
+        if ranges is not None:
+            range_starts = [tokens.starts[start] for start, end in ranges]
+            range_ends = [tokens.ends[end - 1] for start, end in ranges]
+
+            def overlaps(cursor):
+                extent = cursor.extent
+                i = bisect.bisect_right(range_starts, extent.end.offset) - 1
+                return (i >= 0) and (range_ends[i] >= extent.start.offset)
+
+            stack = [c for c in stack if overlaps(c)]
+
+        stack.reverse()
+        decl_ref_id = CursorKind.DECL_REF_EXPR.value if parameter_uses else None
+
+        while stack:
+            cursor = stack.pop()
+            kind = kinds_by_id.get(cursor._kind_id)
+            if kind is not None:
+                self._add(cursor, kind, tokens)
+
+            if cursor._kind_id == decl_ref_id:
+                referenced = conf.lib.clang_getCursorReferenced(cursor)
+                if referenced._kind_id == CursorKind.PARM_DECL.value:
+                    self.parameter_uses[referenced] = self.parameter_uses.get(referenced, 0) + 1
+
+            children = list(cursor.get_children())
+            children.reverse()
+            stack.extend(children)
+
+    def _add(self, cursor, kind, tokens):
+        if not conf.lib.clang_Location_isFromMainFile(cursor.location):
+            return
+
+        extent = cursor.extent
+        start_offset = extent.start.offset
+
+        start = bisect.bisect_left(tokens.starts, start_offset)
+        if (start >= len(tokens)) or (tokens.starts[start] != start_offset):
+            return
+
+        end = bisect.bisect_left(tokens.starts, extent.end.offset, lo=start)
+        entry = IndexedCursor(cursor, kind, start, end)
+
+        self.by_kind[kind].append(entry)
+        self.by_start.setdefault(start, []).append(entry)
+
+    def of_kind(self, kind):
+        return self.by_kind.get(kind, [])
+
+    def starting_at(self, index):
+        return self.by_start.get(index, [])
+
+    def uses(self, param):
+        """
+        Returns the number of times the given PARM_DECL cursor is referred to
+        (only counted if parameter_uses was set)
+        """
+        return self.parameter_uses.get(param, 0)
+
 
 class CodeRewriteRule(object):
+    # While a file is being rewritten, rules can use rewriter.lines (the
+    # LineIndex of the file's current contents) to find line indentation, and
+    # rewriter.cursors (the CursorIndex for the current pass).
+
+    # Token kinds this rule wants passed to consume_token. If this is not set,
+    # and cursor_kinds is not set either, the rule is passed every token.
+    token_kinds = None
+
+    # Cursor kinds this rule wants passed to consume_cursor. Each cursor is
+    # passed once, when the token stream reaches the first token of the cursor.
+    cursor_kinds = None
+
+    # Set this if the rule uses rewriter.cursors.uses(), so that references to
+    # function parameters are counted when the cursors are indexed
+    parameter_uses = False
+
     def __init__(self):
         self.start_index = 0
         self.end_index = 0
@@ -29,48 +796,180 @@ class CodeRewriteRule(object):
     def tokens_buffered(self):
         raise NotImplementedError()
 
-    def consume_token(self, rewriter, index, token, text):
+    def consume_token(self, rewriter, index, tokens, text):
+        raise NotImplementedError()
+
+    def consume_cursor(self, rewriter, entry, tokens, text):
         raise NotImplementedError()
 
     def reset(self):
         pass
 
 
+# Not exposed by the python bindings; makes libclang build the precompiled
+# preamble during the initial parse, instead of during the first re-parse
+PARSE_CREATE_PREAMBLE_ON_FIRST_PARSE = 0x100
+
+
 class CFile(object):
-    TEMP_FILENAME = '_temp.c'
+    # The translation unit is kept alive and re-parsed after each rewrite, so
+    # ask libclang to precompile the preamble (the block of #include directives
+    # at the top of the file). Re-parses only need to re-compile the rest.
+    # Note that libclang only uses the preamble if the main file exists on disk,
+    # which is why the real filename is passed along with the unsaved contents.
+    PARSE_OPTIONS = (TranslationUnit.PARSE_PRECOMPILED_PREAMBLE |
+                     PARSE_CREATE_PREAMBLE_ON_FIRST_PARSE)
 
-    def __init__(self, filename, ignore_errors=False):
-        self.text = None
+    def __init__(self, filename, ignore_errors=False, index=None, text=None, args=None,
+                 pch=None):
+        self.parsed = None
+        self.errors = []
+        self.warnings = []
         self.filename = filename
         self.ignore_errors = ignore_errors
+        self.args = default_compiler_args if args is None else args
+
+        # Precompiled header to include before the file (see SharedPCH)
+        self.pch = pch
 
-        with open(filename, 'r') as fh:
-            self.text = fh.read()
+        # Number of times the file has been parsed (including re-parses), and
+        # the total time spent parsing it
+        self.parse_count = 0
+        self.parse_time = 0.0
 
-        self.idx = clang.cindex.Index.create()
+        self._lines = None
+
+        if text is None:
+            with open(filename, 'r') as fh:
+                text = fh.read()
+
+        self.buffer = TextBuffer(text)
+
+        self.idx = clang.cindex.Index.create() if index is None else index
         if not self._parse():
             self.parsed = None
 
     def _parse(self):
-        self.parsed = self.idx.parse(self.TEMP_FILENAME, args=compiler_args,
-                                     unsaved_files=[(self.TEMP_FILENAME, self.text)])
+        unsaved_files = [(self.filename, self.text)]
+        start = time.perf_counter()
 
-        if not self.ignore_errors:
-            err_lines = []
-            for d in self.parsed.diagnostics:
-                if d.severity > Diagnostic.Warning:
-                    err_lines.append(d.format().replace(self.TEMP_FILENAME, self.filename))
+        if self.parsed is None:
+            args = self.args if (self.pch is None) else self.args + ['-include-pch', self.pch]
+            self.parsed = self.idx.parse(self.filename, args=args,
+                                         unsaved_files=unsaved_files,
+                                         options=self.PARSE_OPTIONS)
+        else:
+            self.parsed.reparse(unsaved_files=unsaved_files)
 
-            if err_lines:
-                print("\nFile '%s' has errors:\n\n%s\n" % (self.filename, '\n'.join(err_lines)))
-                return False
+        self.parse_count += 1
+        self.parse_time += time.perf_counter() - start
+
+        self.errors = []
+        self.warnings = []
+        for d in self.parsed.diagnostics:
+            if d.severity > Diagnostic.Warning:
+                self.errors.append(d.format())
+            elif d.severity == Diagnostic.Warning:
+                self.warnings.append(d.format())
+
+        if self.errors and (not self.ignore_errors):
+            return False
 
         return True
 
+    def has_errors(self):
+        """
+        Returns True if libclang reported any errors when the file was last
+        parsed, even if errors are being ignored
+        """
+        if self.parsed is None:
+            return True
+
+        return any(d.severity > Diagnostic.Warning for d in self.parsed.diagnostics)
+
+    def error_report(self):
+        return "\nFile '%s' has errors:\n\n%s\n" % (self.filename, '\n'.join(self.errors))
+
+    @property
+    def text(self):
+        return self.buffer.text
+
+    def update(self, text):
+        """
+        Replace the contents of the file, and re-parse it. Returns False if
+        the new contents have errors.
+        """
+        self.buffer = TextBuffer(text)
+        return self._parse()
+
+    def edit(self, replacements):
+        """
+        Apply replacements to the contents of the file (see TextBuffer.replace).
+        The file is not re-parsed until reparse() is called.
+        """
+        self.buffer.replace(replacements)
+
+    def reparse(self):
+        """
+        Re-parse the current contents of the file. Returns False if they have
+        errors.
+        """
+        return self._parse()
+
+    @property
+    def lines(self):
+        """
+        LineIndex for the current contents of the file, built when first needed
+        """
+        if (self._lines is None) or (self._lines.text is not self.text):
+            self._lines = LineIndex(self.text)
+
+        return self._lines
+
     def tokens(self, text=None):
         if text is not None:
-            self.text = text
-            if not self._parse():
+            if not self.update(text):
                 return None
 
-        return [t for t in self.parsed.get_tokens(extent=self.parsed.cursor.extent)]
+        return TokenSnapshot(self.parsed, self.parsed.cursor.extent)
+
+
+class ParsedFileCache(object):
+    """
+    Keeps the most recently used files parsed, so that when a file is rewritten
+    again after an edit, its translation unit can be re-parsed (re-using its
+    precompiled preamble) instead of being parsed from scratch.
+    """
+    def __init__(self, index, ignore_errors=False, max_files=32):
+        self.index = index
+        self.ignore_errors = ignore_errors
+        self.max_files = max_files
+
+        # Keyed by filename and compiler arguments, least recently used first
+        self._files = OrderedDict()
+
+    def load(self, filename, text, args, ignore_errors=None):
+        """
+        Returns a CFile with the given contents, and whether it was parsed
+        without errors. ignore_errors overrides the default given to the
+        constructor, for this load only.
+        """
+        key = (filename, tuple(args))
+
+        if ignore_errors is None:
+            ignore_errors = self.ignore_errors
+
+        cf = self._files.pop(key, None)
+        if cf is None:
+            cf = CFile(filename, ignore_errors=ignore_errors, index=self.index,
+                       text=text, args=args)
+            success = cf.parsed is not None
+        else:
+            cf.ignore_errors = ignore_errors
+            success = cf.update(text)
+
+        self._files[key] = cf
+        while len(self._files) > self.max_files:
+            self._files.popitem(last=False)
+
+        return cf, success
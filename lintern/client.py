@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import socket
+import struct
+
+from lintern.output import handle_result, check_summary
+
+
+# Every message is a JSON object, encoded as UTF-8 and preceded by its length
+_HEADER = struct.Struct('>I')
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b''.join(chunks)
+
+
+def recv_message(sock):
+    """
+    Returns the next message received on the given socket, or None if the
+    connection was closed
+    """
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+
+    data = _recv_exact(sock, _HEADER.unpack(header)[0])
+    if data is None:
+        return None
+
+    return json.loads(data.decode('utf-8'))
+
+
+class LinternClient(object):
+    """
+    Sends files to be rewritten by a lintern server (started with 'lintern
+    --serve'), so that each file doesn't pay for starting up lintern and loading
+    libclang. Only depends on the standard library, so that it starts quickly.
+    """
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+
+    def rewrite(self, filename, text, config_data, indent_type='space', indent_level=4,
+                ignore_errors=False):
+        """
+        Rewrite the given file contents
+
+        :param str filename: absolute path of the file
+        :param str text: file contents
+        :param dict config_data: configuration file data (which rules are enabled)
+        :param str indent_type: 'space' or 'tab'
+        :param int indent_level: number of characters per indent level
+        :param bool ignore_errors: rewrite the file even if it has parse errors
+
+        :return: tuple of (rewritten contents, error message). One of them is None.
+        """
+        send_message(self.sock, {
+            'filename': filename,
+            'text': text,
+            'config': config_data,
+            'indent_type': indent_type,
+            'indent_level': indent_level,
+            'ignore_errors': ignore_errors
+        })
+
+        response = recv_message(self.sock)
+        if response is None:
+            return None, "lintern server closed the connection"
+
+        return response.get('text'), response.get('error')
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def rewrite_with_server(args, config_data, filenames=None):
+    """
+    Rewrite all files named in filenames (default is args.filename) using the
+    lintern server listening on args.connect. Like rewrite_parallel, errors in
+    one file do not stop other files from being rewritten, and 1 is returned if
+    any file failed (or, with --check, if any file needs changes).
+    """
+    failed = 0
+    num_changed = 0
+
+    try:
+        client = LinternClient(args.connect)
+    except OSError as e:
+        print("Unable to connect to lintern server at '%s': %s" % (args.connect, e))
+        return 1
+
+    with client:
+        for filename in (args.filename if filenames is None else filenames):
+            try:
+                with open(filename, 'r') as fh:
+                    text = fh.read()
+            except (IOError, ValueError) as e:
+                print("\nFile '%s' could not be parsed: %s\n" % (filename, e))
+                failed += 1
+                continue
+
+            new_file_content, error = client.rewrite(os.path.abspath(filename), text,
+                                                     config_data, args.indent_type,
+                                                     int(args.indent_level),
+                                                     bool(args.ignore_errors))
+            if error is not None:
+                print(error)
+                failed += 1
+            else:
+                changed, output = handle_result(args, filename, text, new_file_content)
+                sys.stdout.write(output)
+                num_changed += changed
+
+    if args.check:
+        sys.stderr.write(check_summary(num_changed) + "\n")
+        if num_changed:
+            return 1
+
+    return 1 if failed else 0
@@ -0,0 +1,102 @@
+import os
+import json
+import shlex
+
+
+COMPILE_COMMANDS_FILENAME = 'compile_commands.json'
+
+# Compiler options that only affect the output of a build, and which make no
+# sense (or make libclang write files) when parsing
+_SKIP_ARGS = ['-c', '-S', '-E', '-M', '-MM', '-MD', '-MMD', '-MG', '-MP']
+
+# As above, but the option is followed by a value, either as the next argument
+# or joined on to the option itself (e.g. '-o foo.o' or '-ofoo.o')
+_SKIP_ARGS_WITH_VALUE = ['-o', '-MF', '-MT', '-MQ']
+
+
+def _path_key(filename):
+    return os.path.normcase(os.path.realpath(filename))
+
+
+def parser_args(argv, filename, directory):
+    """
+    Convert the compiler command line from a compile_commands.json entry into
+    arguments for libclang. The compiler itself, output options and the source
+    file are removed, and relative paths in the remaining options are resolved
+    from the directory the command was run in.
+
+    :param argv: compiler command line, as a list of arguments
+    :param str filename: absolute path of the source file being compiled
+    :param str directory: directory the command was run in
+
+    :return: list of arguments for libclang
+    """
+    ret = []
+    source_key = _path_key(filename)
+    skip_next = False
+
+    for arg in argv[1:]:
+        if skip_next:
+            skip_next = False
+            continue
+
+        if arg in _SKIP_ARGS:
+            continue
+
+        if arg in _SKIP_ARGS_WITH_VALUE:
+            skip_next = True
+            continue
+
+        if any(arg.startswith(a) for a in _SKIP_ARGS_WITH_VALUE):
+            continue
+
+        if (not arg.startswith('-')) and (_path_key(os.path.join(directory, arg)) == source_key):
+            continue
+
+        ret.append(arg)
+
+    return ret + ['-working-directory', directory]
+
+
+class CompileCommands(object):
+    """
+    Per-file compiler arguments, loaded from the compile_commands.json file in
+    a build directory (as generated by CMake, Bear, etc.). The file is read
+    once, and entries are indexed by the real path of the source file.
+    """
+    def __init__(self, build_dir):
+        self.build_dir = build_dir
+        self.entries = {}
+
+        with open(os.path.join(build_dir, COMPILE_COMMANDS_FILENAME), 'r') as fh:
+            data = json.load(fh)
+
+        if not isinstance(data, list):
+            raise ValueError("expected a list of compile commands")
+
+        for entry in data:
+            try:
+                directory = entry['directory']
+                filename = os.path.join(directory, entry['file'])
+
+                if 'arguments' in entry:
+                    argv = entry['arguments']
+                else:
+                    argv = shlex.split(entry['command'])
+            except (KeyError, TypeError):
+                raise ValueError("malformed compile command: %s" % json.dumps(entry))
+
+            # If a file is compiled more than once, use the first command
+            key = _path_key(filename)
+            if key not in self.entries:
+                self.entries[key] = parser_args(argv, filename, directory)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def args_for(self, filename):
+        """
+        Returns the libclang arguments for the given source file, or None if
+        the file has no entry in compile_commands.json
+        """
+        return self.entries.get(_path_key(filename))
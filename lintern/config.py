@@ -0,0 +1,27 @@
+# Names of all the rewrite rules in lintern.rules, in the order they are applied.
+# Kept here, rather than derived from lintern.rules, so that configuration data
+# can be generated and checked without importing libclang.
+rule_names = [
+    'BracesAroundCodeBlocks',
+    'PrototypeFunctionDeclarations',
+    'OneDeclarationPerLine',
+    'InitializeCanonicals',
+    'TerminateElseIfWithElse',
+    'ExplicitUnusedFunctionParams'
+]
+
+
+def get_default_config_data():
+    return {name : True for name in rule_names}
+
+def verify_config_data(cfg_data):
+    default = get_default_config_data()
+
+    for key in cfg_data:
+        if key not in default:
+            return "unrecognised option '%s'" % key
+
+        if not isinstance(cfg_data[key], bool):
+            return "invalid value '%s' for option '%s'" % (str(cfg_data[key]), key)
+
+    return None
@@ -0,0 +1,234 @@
+import os
+import re
+import sys
+
+
+# Files found in directories given as input are rewritten if they match these
+# patterns, unless other patterns are given with --glob
+DEFAULT_GLOBS = ['*.c', '*.h']
+
+
+def _normalize_glob(pattern):
+    # Patterns with no '/' in them match files (or directories) with that name
+    # at any depth, like in .gitignore files
+    if '/' not in pattern:
+        return '**/' + pattern
+
+    return pattern.lstrip('/')
+
+
+def _glob_prefix(pattern):
+    # Returns the directory part of a normalized pattern that has no wildcards
+    # in it, e.g. 'src/' for 'src/*/a.c'
+    end = len(pattern)
+    for c in '*?[':
+        if c in pattern:
+            end = min(end, pattern.index(c))
+
+    return pattern[:pattern.rfind('/', 0, end) + 1]
+
+
+def _glob_regex(pattern):
+    # Translates a normalized glob pattern to a regular expression matched
+    # against paths relative to the directory being walked, with '/' as the
+    # separator. '*' and '?' don't match '/', and '**' matches any number of
+    # directories.
+    ret = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            ret += '(.*/)?'
+            i += 3
+        elif pattern.startswith('/**', i) and (i + 3 == len(pattern)):
+            # Also matches the directory itself, so that it can be skipped
+            ret += '(/.*)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            ret += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            ret += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            ret += '[^/]'
+            i += 1
+        elif (pattern[i] == '[') and (']' in pattern[i + 2:]):
+            end = pattern.index(']', i + 2)
+            chars = pattern[i + 1:end]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+
+            ret += '[' + chars.replace('\\', '\\\\') + ']'
+            i = end + 1
+        else:
+            ret += re.escape(pattern[i])
+            i += 1
+
+    return re.compile(ret + r'\Z')
+
+
+class GlobFilter(object):
+    """
+    Decides which files in a directory tree should be rewritten, from a list of
+    glob patterns. Patterns starting with '!' exclude the paths they match.
+    Where more than one pattern matches a path, the last one wins, so e.g.
+    ['*.c', '!third_party/**', 'third_party/ours/*.c'] selects all C files
+    outside third_party/, and the C files in third_party/ours/. If no patterns
+    (other than exclusions) are given, DEFAULT_GLOBS are used.
+    """
+    def __init__(self, patterns=[]):
+        if all(p.startswith('!') for p in patterns):
+            patterns = DEFAULT_GLOBS + list(patterns)
+
+        # List of (regex, exclude, prefix) tuples
+        self.patterns = []
+        for p in patterns:
+            exclude = p.startswith('!')
+            normalized = _normalize_glob(p[1:] if exclude else p)
+            self.patterns.append((_glob_regex(normalized), exclude, _glob_prefix(normalized)))
+
+    def _last_match(self, relpath):
+        # Returns the index of the last pattern matching the path, or -1
+        ret = -1
+        for i in range(len(self.patterns)):
+            if self.patterns[i][0].match(relpath):
+                ret = i
+
+        return ret
+
+    def includes_file(self, relpath):
+        i = self._last_match(relpath)
+        return (i >= 0) and (not self.patterns[i][1])
+
+    def excludes_dir(self, relpath):
+        """
+        Returns True if no files in the given directory can be selected, so the
+        directory does not need to be walked
+        """
+        i = self._last_match(relpath)
+        if (i < 0) or (not self.patterns[i][1]):
+            return False
+
+        # A later pattern may still select files inside the directory
+        relpath += '/'
+        for regex, exclude, prefix in self.patterns[i + 1:]:
+            if (not exclude) and (prefix.startswith(relpath) or relpath.startswith(prefix)):
+                return False
+
+        return True
+
+
+def relative_path(root, path):
+    """
+    Returns the path of a file or directory under root, relative to root and
+    with '/' as the separator, as matched by GlobFilter
+    """
+    ret = os.path.relpath(path, root).replace(os.sep, '/')
+    return '' if ret == '.' else ret
+
+
+def _walk(root, glob_filter, start):
+    # os.walk, skipping directories which are excluded. Generates the path of
+    # each directory, its path relative to root (ending with '/', or empty for
+    # root itself) and the names of the files in it.
+    for dirpath, dirnames, filenames in os.walk(root if start is None else start):
+        reldir = relative_path(root, dirpath)
+        reldir = reldir + '/' if reldir else reldir
+
+        dirnames[:] = sorted(d for d in dirnames if not glob_filter.excludes_dir(reldir + d))
+        yield dirpath, reldir, filenames
+
+
+def walk_dirs(root, glob_filter, start=None):
+    """
+    Generates the paths of all directories under a directory which are not
+    excluded by the given GlobFilter, including the directory itself. If start
+    is given, only the directories under start (a directory under root) are
+    generated, but patterns are still matched relative to root.
+    """
+    for dirpath, reldir, filenames in _walk(root, glob_filter, start):
+        yield dirpath
+
+
+def walk_files(root, glob_filter, start=None):
+    """
+    Generates the paths of all files under a directory which are selected by
+    the given GlobFilter, in sorted order. Directories which are excluded are
+    not walked at all. start is as for walk_dirs.
+    """
+    for dirpath, reldir, filenames in _walk(root, glob_filter, start):
+        for name in sorted(filenames):
+            if glob_filter.includes_file(reldir + name):
+                yield os.path.join(dirpath, name)
+
+
+def _read_list_file(filename):
+    # Generates the non-empty lines of a file, one path per line
+    with open(filename, 'r') as fh:
+        for line in fh:
+            line = line.rstrip('\r\n')
+            if line:
+                yield line
+
+
+def _read_null_separated(fh):
+    # Generates NUL-separated paths from a binary file object, as they are read
+    read = getattr(fh, 'read1', fh.read)
+    pending = b''
+
+    while True:
+        data = read(65536)
+        if not data:
+            break
+
+        items = (pending + data).split(b'\0')
+        pending = items.pop()
+        for item in items:
+            if item:
+                yield os.fsdecode(item)
+
+    if pending:
+        yield os.fsdecode(pending)
+
+
+def _read_files0_from(filename):
+    if filename == '-':
+        yield from _read_null_separated(sys.stdin.buffer)
+        return
+
+    with open(filename, 'rb') as fh:
+        yield from _read_null_separated(fh)
+
+
+def _expand_path(path, glob_filter):
+    if os.path.isdir(path):
+        yield from walk_files(path, glob_filter)
+    else:
+        yield path
+
+
+def input_files(paths, patterns=[], files0_from=None):
+    """
+    Generates the names of all files to rewrite, as they are found, so that
+    files can be rewritten while the rest are still being searched for
+
+    :param list paths: filenames and directories given on the command line. \
+        Directories are searched recursively for files matching the patterns, \
+        and '@FILE' reads more paths (one per line) from FILE.
+    :param list patterns: glob patterns for selecting files in directories, \
+        see GlobFilter
+    :param str files0_from: file to read more paths from, separated by NUL \
+        characters ('-' for stdin)
+    """
+    glob_filter = GlobFilter(patterns)
+
+    for path in paths:
+        if path.startswith('@'):
+            for listed in _read_list_file(path[1:]):
+                yield from _expand_path(listed, glob_filter)
+        else:
+            yield from _expand_path(path, glob_filter)
+
+    if files0_from is not None:
+        for listed in _read_files0_from(files0_from):
+            yield from _expand_path(listed, glob_filter)
@@ -0,0 +1,85 @@
+import os
+import stat
+import difflib
+import tempfile
+
+
+def unified_diff(filename, old_text, new_text):
+    """
+    Returns a unified diff between the original and rewritten contents of a
+    file, which can be applied with 'patch -p0'. Returns an empty string if the
+    contents are the same.
+    """
+    lines = difflib.unified_diff(old_text.splitlines(True), new_text.splitlines(True),
+                                 fromfile=filename, tofile=filename)
+
+    ret = []
+    for line in lines:
+        if line.endswith('\n'):
+            ret.append(line)
+        else:
+            ret.append(line + '\n\\ No newline at end of file\n')
+
+    return ''.join(ret)
+
+
+def replace_file(filename, text):
+    """
+    Replace the contents of a file. The new contents are written to a temporary
+    file in the same directory, which is then renamed over the original file, so
+    that the file is never seen half-written. The original file's permissions
+    are kept.
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmppath = tempfile.mkstemp(dir=dirname, prefix='.%s.' % os.path.basename(filename),
+                                   suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(text)
+
+        os.chmod(tmppath, stat.S_IMODE(os.stat(filename).st_mode))
+        os.replace(tmppath, filename)
+    except:
+        os.unlink(tmppath)
+        raise
+
+
+def handle_result(args, filename, old_text, new_text):
+    """
+    Deal with the result of rewriting a file, according to the --check and
+    --in-place options. With --check, nothing is written, and a diff is produced
+    for files that need changes. With --in-place, files are only replaced if
+    their contents changed, so that unchanged files keep their modification
+    times. Otherwise, the rewritten file is produced.
+
+    :param args: parsed command-line arguments
+    :param str filename: name of the file that was rewritten
+    :param str old_text: original contents of the file
+    :param str new_text: rewritten contents of the file
+
+    :return: tuple of the form (changed, output), where 'changed' is True if the \
+        file needed changes, and 'output' is the text to write to stdout (may be \
+        empty)
+    """
+    changed = new_text != old_text
+
+    if args.check:
+        return changed, unified_diff(filename, old_text, new_text)
+
+    if args.in_place:
+        if changed:
+            replace_file(filename, new_text)
+
+        return changed, ''
+
+    return changed, new_text + '\n'
+
+
+def check_summary(num_changed):
+    """
+    Returns the message printed at the end of a --check run
+    """
+    if num_changed == 0:
+        return "lintern: no changes needed"
+
+    return "lintern: %d file%s would be rewritten" % (num_changed, '' if num_changed == 1 else 's')
@@ -0,0 +1,239 @@
+import os
+import re
+import time
+import shutil
+import tempfile
+import itertools
+from collections import Counter
+
+from clang.cindex import TranslationUnit, TranslationUnitLoadError, Diagnostic
+
+
+# Number of input files to look at, when finding the headers that most files
+# start by including
+SAMPLE_FILES = 32
+
+# Minimum number of the sampled files that must start with the same headers for
+# a shared PCH to be worth building
+MIN_FILES = 4
+
+# Number of characters read from the start of each sampled file
+_HEAD_SIZE = 65536
+
+# Whitespace, a comment, or an #include directive (capturing the header name)
+_leading_item = re.compile(r'\s+|//[^\n]*|/\*.*?\*/|#[ \t]*include[ \t]*([<"][^>"\n]+[>"])[^\n]*',
+                           re.DOTALL)
+
+
+def leading_includes(text):
+    """
+    Returns the headers included by the #include directives at the start of
+    some C code (before anything else apart from comments), as they are written
+    in the directives, e.g. ['<stdint.h>', '"hal.h"']
+    """
+    ret = []
+    pos = 0
+
+    while True:
+        m = _leading_item.match(text, pos)
+        if (m is None) or (m.end() == pos):
+            break
+
+        if m.group(1) is not None:
+            ret.append(m.group(1))
+
+        pos = m.end()
+
+    return ret
+
+
+def common_includes(include_lists, min_files=MIN_FILES):
+    """
+    Returns the longest list of headers that at least half of the given lists
+    of included headers (and at least min_files of them) start with
+    """
+    needed = max(min_files, (len(include_lists) + 1) // 2)
+    matching = include_lists
+    ret = []
+
+    while True:
+        n = len(ret)
+        counts = Counter(l[n] for l in matching if len(l) > n)
+        if not counts:
+            break
+
+        include, count = counts.most_common(1)[0]
+        if count < needed:
+            break
+
+        ret.append(include)
+        matching = [l for l in matching if (len(l) > n) and (l[n] == include)]
+
+    return ret
+
+
+def _read_head(filename):
+    try:
+        with open(filename, 'r') as fh:
+            return fh.read(_HEAD_SIZE)
+    except (IOError, UnicodeDecodeError):
+        return None
+
+
+class SharedPCH(object):
+    """
+    Precompiled header which is built once, and then used for parsing every file
+    that starts by including the same headers (or for every file, if it is
+    built from an umbrella header given by the user), so that those headers
+    don't have to be parsed again for each file. It can only be used for files
+    parsed with exactly the same compiler arguments it was built with.
+
+    :param list includes: headers to precompile (see leading_includes), or \
+        None if an umbrella header is given
+    :param list args: compiler arguments
+    :param str directory: directory that headers included with quotes are \
+        found relative to
+    :param str header: umbrella header to precompile instead of 'includes'
+    """
+    # Name of the (unsaved) header holding the #include directives, placed in
+    # 'directory' so that headers included with quotes are found from there
+    HEADER_NAME = '.lintern-pch.h'
+
+    def __init__(self, includes, args, directory=None, header=None):
+        self.includes = includes
+        self.args = args
+        self.directory = directory
+        self.header = header
+        self.path = None
+        self.errors = []
+
+        # Number of files parsed with the PCH, and number that had to be parsed
+        # again without it (in this process)
+        self.used = 0
+        self.fallbacks = 0
+
+        # Time taken to parse the headers, and to build the PCH as a whole
+        self.parse_time = 0.0
+        self.build_time = 0.0
+
+        self._tmpdir = None
+
+    def build(self, index):
+        """
+        Parse the headers and save the PCH in a temporary directory. Returns
+        False (and sets self.errors) if the headers could not be parsed.
+        """
+        if self.header is not None:
+            filename = os.path.abspath(self.header)
+            unsaved_files = []
+        else:
+            filename = os.path.join(self.directory, self.HEADER_NAME)
+            text = ''.join('#include %s\n' % include for include in self.includes)
+            unsaved_files = [(filename, text)]
+
+        start = time.perf_counter()
+
+        try:
+            tu = index.parse(filename, args=self.args + ['-x', 'c-header'],
+                             unsaved_files=unsaved_files, options=TranslationUnit.PARSE_INCOMPLETE)
+        except TranslationUnitLoadError as e:
+            self.errors = [str(e)]
+            return False
+
+        self.parse_time = time.perf_counter() - start
+
+        self.errors = [d.format() for d in tu.diagnostics if d.severity > Diagnostic.Warning]
+        if self.errors:
+            return False
+
+        self._tmpdir = tempfile.mkdtemp(prefix='lintern-pch-')
+        self.path = os.path.join(self._tmpdir, 'shared.pch')
+        tu.save(self.path)
+
+        self.build_time = time.perf_counter() - start
+        return True
+
+    def usable_for(self, filename, text, args):
+        """
+        Returns True if the PCH can be used for parsing the given file
+        """
+        if (self.path is None) or (args != self.args):
+            return False
+
+        if (self.used == 0) and (self.fallbacks >= MIN_FILES):
+            # None of the files it has been tried with so far could use it, so
+            # stop wasting time on parsing every file twice
+            return False
+
+        if self.includes is None:
+            return True
+
+        if leading_includes(text)[:len(self.includes)] != self.includes:
+            return False
+
+        # Headers included with quotes (and relative paths) are looked for next
+        # to the including file first, so the same directive can mean different
+        # headers in different directories
+        if any(include.startswith('"') and (not os.path.isabs(include[1:-1]))
+               for include in self.includes):
+            if os.path.dirname(os.path.abspath(filename)) != self.directory:
+                return False
+
+        return True
+
+    def close(self):
+        """
+        Delete the PCH file
+        """
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+            self.path = None
+
+
+def find_shared_pch(filenames, compiler_args_for, header=None):
+    """
+    Look at the first few files that are going to be rewritten, and decide what
+    to build a SharedPCH from. Returns the SharedPCH (not built yet), or None if
+    there is no set of headers that enough of the files start by including, and
+    an iterable of all the filenames (since 'filenames' may be a generator,
+    whose first items have now been used up).
+
+    :param filenames: iterable of names of files that are going to be rewritten
+    :param compiler_args_for: function returning the filename to parse a file \
+        as, and the compiler arguments to parse it with
+    :param str header: umbrella header to build the PCH from, instead of \
+        finding common headers
+    """
+    filenames = iter(filenames)
+    sample = list(itertools.islice(filenames, SAMPLE_FILES))
+    filenames = itertools.chain(sample, filenames)
+
+    # (parse filename, args, included headers) for each readable file
+    files = []
+    for filename in sample:
+        text = _read_head(filename)
+        if text is not None:
+            parse_filename, args = compiler_args_for(filename)
+            files.append((parse_filename, args, leading_includes(text)))
+
+    if not files:
+        return None, filenames
+
+    # Use the compiler arguments that most files are parsed with
+    args = Counter(tuple(f[1]) for f in files).most_common(1)[0][0]
+    files = [f for f in files if tuple(f[1]) == args]
+
+    if header is not None:
+        return SharedPCH(None, list(args), header=header), filenames
+
+    includes = common_includes([f[2] for f in files])
+    if not includes:
+        return None, filenames
+
+    # Where headers are included with quotes, use the directory that most of
+    # the files which start with these headers are in
+    dirs = Counter(os.path.dirname(os.path.abspath(f[0])) for f in files
+                   if f[2][:len(includes)] == includes)
+
+    return SharedPCH(includes, list(args), dirs.most_common(1)[0][0]), filenames
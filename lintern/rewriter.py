@@ -1,31 +1,130 @@
+import os
+import sys
+import multiprocessing
+
+import clang.cindex
+from clang.cindex import TokenKind, TranslationUnitLoadError
+
 from lintern import rules
-from lintern.cfile import CFile
+from lintern.cache import ResultCache
+from lintern.config import rule_names
+from lintern.stats import RewriteStats, RuleStats
+from lintern.trace import TraceWriter, trace_clock
+from lintern.output import handle_result, check_summary
+from lintern.pch import find_shared_pch
+from lintern.cfile import CFile, CursorIndex, ReplacementBatch, default_compiler_args
+
+
+rewrite_rules = [getattr(rules, name)() for name in rule_names]
+
+class CachedResult(object):
+    """
+    Stands in for a CFile when the result of rewriting a file was found in the
+    result cache, and the file does not need to be parsed
+    """
+    def __init__(self, filename, text, new_text):
+        self.filename = filename
+        self.text = text
+        self.new_text = new_text
+
+
+class InstrumentedRule(object):
+    """
+    Stands in for a rewrite rule in CodeRewriter's dispatch tables when stats or
+    tracing are enabled. Counts and times the calls to the rule (in 'stats', a
+    RuleStats for the current pass), and records a trace event for each
+    replacement it generates. Rules are only wrapped when stats or tracing are
+    enabled, so there is no cost otherwise.
+    """
+    def __init__(self, rule, priority, trace=None):
+        self.rule = rule
+        self.priority = priority
+        self.trace = trace
+        self.stats = RuleStats(rule.__class__.__name__)
+
+        # (replacement, trace event args) for each replacement generated in the
+        # current pass, see finish_pass
+        self._traced = []
+
+    def _generated(self, rep, start, end):
+        self.stats.proposed += 1
+
+        if self.trace is not None:
+            args = {
+                'token_index': rep.start_token_index,
+                'offset': min(rep.start, rep.end),
+                'replaced_bytes': abs(rep.end - rep.start),
+                'replacement_bytes': len(rep.replacement_text.encode('utf-8'))
+            }
+
+            self.trace.span(self.stats.name, 'rule', start, end, args)
+            self._traced.append((rep, args))
+
+    def consume_cursor(self, rewriter, entry, tokens, text):
+        start = trace_clock()
+        ret = self.rule.consume_cursor(rewriter, entry, tokens, text)
+        end = trace_clock()
+
+        self.stats.time += end - start
+        self.stats.cursors += 1
+
+        if ret is not None:
+            self._generated(ret, start, end)
+
+        return ret
+
+    def consume_token(self, rewriter, index, tokens, text):
+        start = trace_clock()
+        ret = self.rule.consume_token(rewriter, index, tokens, text)
+        end = trace_clock()
+
+        self.stats.time += end - start
+        self.stats.tokens += 1
+
+        if ret is not None:
+            self._generated(ret, start, end)
 
+        return ret
+
+    def finish_pass(self, batch):
+        """
+        Record which of the replacements generated in this pass are in the
+        batch that is going to be applied, and start counting for a new pass.
+        Returns the RuleStats for the pass that just finished.
+        """
+        self.stats.applied = batch.priorities.count(self.priority)
+
+        applied = set(id(rep) for rep in batch.replacements)
+        for rep, args in self._traced:
+            args['accepted'] = id(rep) in applied
+
+        ret = self.stats
+        self.stats = RuleStats(ret.name)
+        self._traced = []
+        return ret
 
-rewrite_rules = [
-    rules.BracesAroundCodeBlocks(),
-    rules.PrototypeFunctionDeclarations(),
-    rules.OneDeclarationPerLine(),
-    rules.InitializeCanonicals(),
-    rules.TerminateElseIfWithElse(),
-    rules.ExplicitUnusedFunctionParams()
-]
 
 class CodeRewriter(object):
-    def __init__(self, args, config_data):
+    def __init__(self, args, config_data, filenames=None, include_args=[],
+                 compile_commands=None, process_name='lintern'):
         self.config = args
         self.rules = []
-        self.files = []
+        self.cache = None
+        self.stats = None
+        self.trace = None
+        self.index = None
+        self.pch = None
+        self.lines = None
+        self.cursors = None
+        self.include_args = include_args
+        self.compile_commands = compile_commands
+        self.default_args = default_compiler_args + include_args
 
-        for f in args.filename:
-            fobj = CFile(f, ignore_errors=args.ignore_errors)
-            if fobj.parsed is None:
-                # Parse failed
-                self.files = None
-                return
+        # Files are only read and parsed as they are rewritten, see rewrite()
+        self.filenames = args.filename if filenames is None else filenames
 
-            # Parse successful
-            self.files.append(fobj)
+        # Number of files that could not be rewritten
+        self.failed = 0
 
         # Build list of rules that are enabled in the config file
         for r in rewrite_rules:
@@ -33,46 +132,516 @@ class CodeRewriter(object):
             if (name in config_data) and (config_data[name] == True):
                 self.rules.append(r)
 
+        if args.cache_dir is not None:
+            self.cache = ResultCache(args.cache_dir, args.cache_size * 1024 * 1024,
+                                     [r.__class__.__name__ for r in self.rules], args)
+
+        if args.stats:
+            self.stats = RewriteStats([r.__class__.__name__ for r in self.rules])
+
+        if args.trace is not None:
+            self.trace = TraceWriter(process_name=process_name)
+
+        # What the dispatch tables hand tokens and cursors to: the rules, or
+        # InstrumentedRule instances wrapping them
+        if (self.stats is not None) or (self.trace is not None):
+            self._consumers = [InstrumentedRule(self.rules[i], i, self.trace)
+                               for i in range(len(self.rules))]
+        else:
+            self._consumers = self.rules
+
+        # Which rules want to consume each cursor kind, in the same order as
+        # self.rules, and the index of each rule (used as its priority)
+        self._cursor_dispatch = {}
+        for i in range(len(self.rules)):
+            for kind in (self.rules[i].cursor_kinds or []):
+                self._cursor_dispatch.setdefault(kind, []).append((i, self._consumers[i]))
+
+        self._parameter_uses = any(r.parameter_uses for r in self.rules)
+
+        self._token_dispatch = {}
+
+    def _rules_for_token(self, token_kind_id):
+        # Returns (priority, rule) pairs for all rules that want to consume tokens
+        # with the given token kind ID, in the same order as self.rules
+        ret = self._token_dispatch.get(token_kind_id)
+
+        if ret is None:
+            token_kind = TokenKind.from_value(token_kind_id)
+
+            ret = []
+            for i in range(len(self.rules)):
+                r = self.rules[i]
+                wants_all = (r.token_kinds is None) and (r.cursor_kinds is None)
+                if wants_all or ((r.token_kinds is not None) and (token_kind in r.token_kinds)):
+                    ret.append((i, self._consumers[i]))
+
+            self._token_dispatch[token_kind_id] = ret
+
+        return ret
+
+    def _collect_replacements(self, cf, tokens, ranges=None, first_rule=0):
+        # Feeds the tokens in the given (start, end) ranges of token indices (or
+        # all tokens, if no ranges are given) to the rules. Rules are reset at
+        # the start of each range. Replacements from rules before first_rule
+        # (the index of a rule in self.rules) are ignored.
+        batch = ReplacementBatch(first_rule)
+
+        if self.trace is not None:
+            start = trace_clock()
+
+        cursors = CursorIndex(cf.parsed, tokens, list(self._cursor_dispatch.keys()), ranges,
+                              parameter_uses=self._parameter_uses)
+        if self.trace is not None:
+            self.trace.span('index cursors', 'rewrite', start, trace_clock())
+
+        kinds = tokens.kinds
+        text = cf.text
+        self.lines = cf.lines
+        self.cursors = cursors
+
+        if ranges is None:
+            ranges = [(0, len(tokens))]
+
+        # Where replacements overlap, the one from the rule listed first wins,
+        # and the rest are picked up by the next pass over the re-parsed file
+        for start, end in ranges:
+            for r in self.rules:
+                r.reset()
+
+            for i in range(start, end):
+                for entry in cursors.starting_at(i):
+                    for priority, rule in self._cursor_dispatch[entry.kind]:
+                        ret = rule.consume_cursor(self, entry, tokens, text)
+                        if ret is not None:
+                            batch.add(ret, priority)
+
+                for priority, rule in self._rules_for_token(kinds[i]):
+                    ret = rule.consume_token(self, i, tokens, text)
+                    if ret is not None:
+                        batch.add(ret, priority)
+
+        batch.defer_later_rules()
+        return batch
+
+    def _finish_pass(self, cf, batch, ranges):
+        # Collects the stats for a pass over the file, from the InstrumentedRule
+        # instances. Returns a list of RuleStats for the pass, in the same order
+        # as self.rules.
+        rule_stats = [c.finish_pass(batch) for c in self._consumers]
+
+        if self.stats is not None:
+            for total, pass_stats in zip(self.stats.rules, rule_stats):
+                total.merge(pass_stats)
+
+            file_stats = self.stats.file(cf.filename)
+            file_stats.passes += 1
+            file_stats.tokens += sum(end - start for start, end in ranges)
+            file_stats.rule_time += sum(r.time for r in rule_stats)
+            file_stats.proposed += sum(r.proposed for r in rule_stats)
+            file_stats.applied += len(batch.replacements)
+
+        return rule_stats
+
+    def _compiler_args_for(self, filename):
+        # Returns the filename to parse the file as, and the compiler arguments to
+        # parse it with
+        if self.compile_commands is not None:
+            args = self.compile_commands.args_for(filename)
+            if args is not None:
+                # Compile commands are run from their own working directory, so
+                # the file must be passed to libclang with an absolute path
+                return os.path.abspath(filename), args + self.include_args
+
+        return filename, self.default_args
+
+    def _load_file(self, filename):
+        instrumented = (self.stats is not None) or (self.trace is not None)
+        if instrumented:
+            start = trace_clock()
+
+        with open(filename, 'r') as fh:
+            text = fh.read()
+
+        parse_filename, compiler_args = self._compiler_args_for(filename)
+
+        ret = None
+        if self.cache is not None:
+            cached = self.cache.get(text, compiler_args)
+            if cached is not None:
+                ret = CachedResult(filename, text, cached)
+
+        if ret is None:
+            ret = self._parse_file(parse_filename, text, compiler_args)
+
+        if instrumented:
+            cached = isinstance(ret, CachedResult)
+
+            if self.stats is not None:
+                self.stats.file(ret.filename).cached = cached
+
+            if self.trace is not None:
+                self.trace.span('cache hit' if cached else 'parse', 'parse', start,
+                                trace_clock(), {'file': ret.filename})
+
+        return ret
+
+    def _parse_file(self, filename, text, compiler_args):
+        # Parse a file with the shared PCH, if there is one that can be used for
+        # it. If the file can't be parsed cleanly with the PCH (e.g. a header
+        # with no include guard ends up being included twice), it is parsed
+        # again without it.
+        if (self.pch is not None) and self.pch.usable_for(filename, text, compiler_args):
+            try:
+                ret = CFile(filename, ignore_errors=self.config.ignore_errors,
+                            index=self.index, text=text, args=compiler_args,
+                            pch=self.pch.path)
+            except TranslationUnitLoadError:
+                ret = None
+
+            if (ret is not None) and (not ret.has_errors()):
+                self.pch.used += 1
+                if self.stats is not None:
+                    self.stats.file(filename).pch = 'used'
+
+                return ret
+
+            self.pch.fallbacks += 1
+            if self.stats is not None:
+                self.stats.file(filename).pch = 'fallback'
+
+        return CFile(filename, ignore_errors=self.config.ignore_errors, index=self.index,
+                     text=text, args=compiler_args)
+
+    def _prepare_pch(self, filenames):
+        # Build a SharedPCH for the files about to be rewritten, if enough of
+        # them start with the same headers (or an umbrella header was given).
+        # Returns all the filenames, since the first few have been looked at.
+        if (not self.config.pch) and (self.config.pch_header is None):
+            return filenames
+
+        if (self.stats is not None) or (self.trace is not None):
+            start = trace_clock()
+
+        pch, filenames = find_shared_pch(filenames, self._compiler_args_for,
+                                         header=self.config.pch_header)
+        if pch is None:
+            return filenames
+
+        if self.index is None:
+            self.index = clang.cindex.Index.create()
+
+        if not pch.build(self.index):
+            sys.stderr.write("lintern: not using a precompiled header, headers could not "
+                             "be parsed:\n%s\n" % '\n'.join(pch.errors))
+            return filenames
+
+        self.pch = pch
+
+        if self.stats is not None:
+            self.stats.pch_parse_time = pch.parse_time
+            self.stats.pch_build_time = pch.build_time
+
+        if self.trace is not None:
+            self.trace.span('build pch', 'parse', start, trace_clock(),
+                            {'headers': pch.header or ' '.join(pch.includes)})
+
+        return filenames
+
+    def _close_pch(self):
+        if self.pch is not None:
+            self.pch.close()
+            self.pch = None
+
+    def _rewrite_file_cached(self, f):
+        if isinstance(f, CachedResult):
+            return f.new_text
+
+        original_text = f.text
+        new_file_content = self._rewrite_file(f)
+
+        if (new_file_content is not None) and (self.cache is not None):
+            self.cache.put(original_text, f.args, new_file_content)
+
+        return new_file_content
+
+    def _finish_file(self, f, start):
+        # Record the time spent on a file, from before it was read and parsed
+        # until it was rewritten, so that all of its other spans nest inside
+        end = trace_clock()
+        cached = isinstance(f, CachedResult)
+
+        if self.stats is not None:
+            file_stats = self.stats.file(f.filename)
+            file_stats.time += end - start
+            if not cached:
+                file_stats.parse_time = f.parse_time
+                file_stats.reparses = f.parse_count - 1
+
+        if self.trace is not None:
+            self.trace.span(f.filename, 'file', start, end,
+                            None if cached else {'reparses': f.parse_count - 1})
+
     def _rewrite_file(self, cf):
+        instrumented = (self.stats is not None) or (self.trace is not None)
+        trace = self.trace
+
+        if instrumented:
+            start = trace_clock()
+
         tokens = cf.tokens()
+        if trace is not None:
+            trace.span('tokenize', 'parse', start, trace_clock(), {'tokens': len(tokens)})
+
         if not tokens:
-            return None
-
-        i = 0
-        restart = False
-
-        for r in self.rules:
-            r.reset()
-            i = 0
-            while i < len(tokens):
-                ret = r.consume_token(self, i, tokens, cf.text)
-                if ret is None:
-                    # No replacement text generated, move to the next token
-                    i += 1
-                    continue
+            return cf.text
 
-                # This rule generated some replacement text; need to perform the
-                # rewrite for the given CodeChunkReplacement, re-generate the stream
-                # of tokens for the entire file, and continue the token-processing
-                # loop starting from the first token of our new replacement code.
-                newtext = cf.text[:ret.start] + ret.replacement_text + cf.text[ret.end:]
-                tokens = cf.tokens(text=newtext)
-                if tokens is None:
-                    return None
+        pass_num = 0
+        ranges = None
+        first_rule = 0
+        while True:
+            # Walk the token stream once, feeding each token to all the rules
+            # that want it and collecting all the replacements they generate,
+            # then perform all of them with a single rewrite and re-parse.
+            # Another pass is only needed if some replacements overlapped (e.g.
+            # nested code blocks, or two rules rewriting the same statement).
+            if instrumented:
+                pass_start = trace_clock()
 
-                i = ret.start_token_index
-                r.reset()
+            batch = self._collect_replacements(cf, tokens, ranges, first_rule)
+
+            if instrumented:
+                pass_ranges = [(0, len(tokens))] if (ranges is None) else ranges
+                rule_stats = self._finish_pass(cf, batch, pass_ranges)
+                pass_end = trace_clock()
+
+                if trace is not None:
+                    pass_args = {r.name + ' ms': r.time * 1000.0 for r in rule_stats}
+                    pass_args['regions'] = 'all' if (ranges is None) else len(ranges)
+                    trace.span('pass %d' % pass_num, 'pass', pass_start, pass_end, pass_args)
+
+                pass_num += 1
+
+            if not batch.replacements:
+                break
+
+            cf.edit(batch.replacements)
+
+            if trace is not None:
+                # Count joining the edited contents into one string as part of
+                # applying the edits, rather than re-parsing
+                cf.text
+                reparse_start = trace_clock()
+                trace.span('apply edits', 'edit', pass_end, reparse_start,
+                           {'edits': len(batch.replacements), 'conflicts': batch.conflicts})
+
+            success = cf.reparse()
+
+            if trace is not None:
+                reparse_end = trace_clock()
+                trace.span('reparse', 'parse', reparse_start, reparse_end)
+
+            if not success:
+                return None
+
+            if not batch.conflicts:
+                break
+
+            # The rules found nothing to change anywhere else in the file, so
+            # the next pass only needs to look at the top-level declarations
+            # that were just edited, or had edits dropped. Only those need to
+            # be tokenized again, too.
+            tokens, ranges = tokens.updated(batch.edited_spans(), len(cf.text))
+            first_rule = batch.first_conflict
+
+            if trace is not None:
+                trace.span('tokenize', 'parse', reparse_end, trace_clock(),
+                           {'tokens': sum(end - start for start, end in ranges)})
 
         return cf.text
 
+    def _rewrite_one(self, filename):
+        # Parse and rewrite a single file, and deal with the result (see
+        # handle_result). Returns a tuple of the form (result, error), where
+        # 'result' is the (changed, output) tuple from handle_result, or None if
+        # the file could not be rewritten, in which case 'error' is the message
+        # to report.
+        instrumented = (self.stats is not None) or (self.trace is not None)
+        if instrumented:
+            start = trace_clock()
+
+        try:
+            f = self._load_file(filename)
+        except (IOError, ValueError, TranslationUnitLoadError) as e:
+            # ValueError includes UnicodeDecodeError, for files that aren't text
+            return None, "\nFile '%s' could not be parsed: %s\n" % (filename, e)
+
+        if (not isinstance(f, CachedResult)) and (f.parsed is None):
+            if instrumented:
+                self._finish_file(f, start)
+
+            return None, f.error_report()
+
+        original_text = f.text
+        new_file_content = self._rewrite_file_cached(f)
+
+        if instrumented:
+            self._finish_file(f, start)
+
+        # Nothing else refers to the translation unit, so it is disposed of as
+        # soon as this returns, rather than when the next file is rewritten
+        self.lines = None
+        self.cursors = None
+
+        if new_file_content is None:
+            return None, f.error_report()
+
+        return handle_result(self.config, filename, original_text, new_file_content), None
+
     def rewrite(self):
-        for f in self.files:
-            new_file_content = self._rewrite_file(f)
-            if new_file_content is None:
-                return
-
-            if self.config.in_place:
-                with open(f.filename, 'w') as fh:
-                    fh.write(new_file_content)
-            else:
-                print(new_file_content)
+        """
+        Rewrite all files, one at a time. Each file is parsed, rewritten and
+        written out before the next one is read, so only one translation unit
+        is in memory at a time, and output starts straight away. Errors are
+        reported as soon as they are found, and do not stop the remaining files
+        from being rewritten; self.failed is the number of files that failed.
+
+        :return: number of files that needed changes
+        """
+        if self.index is None:
+            self.index = clang.cindex.Index.create()
+
+        num_changed = 0
+        filenames = self._prepare_pch(self.filenames)
+
+        try:
+            for filename in filenames:
+                result, error = self._rewrite_one(filename)
+                if error is not None:
+                    print(error)
+                    self.failed += 1
+                    continue
+
+                changed, output = result
+                sys.stdout.write(output)
+                num_changed += changed
+        finally:
+            self._close_pch()
+
+        return num_changed
+
+    def finish(self):
+        if self.cache is not None:
+            self.cache.prune()
+            sys.stderr.write(self.cache.summary() + "\n")
+
+        if self.stats is not None:
+            sys.stderr.write(self.stats.report(self.config.stats_format) + "\n")
+
+        if self.trace is not None:
+            self.trace.write(self.config.trace)
+
+
+# Per-process state for the worker processes used by rewrite_parallel
+_worker = None
+
+
+def _init_worker(args, config_data, include_args, compile_commands, pch):
+    global _worker
+
+    _worker = CodeRewriter(args, config_data, filenames=[], include_args=include_args,
+                           compile_commands=compile_commands, process_name='lintern worker')
+
+    # Built by the parent process, which also deletes it when finished
+    _worker.pch = pch
+
+    # libclang objects cannot be pickled, so each worker needs its own index
+    _worker.index = clang.cindex.Index.create()
+
+
+def _rewrite_worker(filename):
+    # Stats and trace events are collected separately for each file, and sent
+    # back to be totalled up by the parent process
+    if _worker.stats is not None:
+        _worker.stats = RewriteStats([r.name for r in _worker.stats.rules])
+
+    ret = _rewrite_worker_file(filename)
+    trace_events = None if (_worker.trace is None) else _worker.trace.take_events()
+
+    return ret + (_worker.stats, trace_events)
+
+
+def _rewrite_worker_file(filename):
+    cache = _worker.cache
+    counts = None if (cache is None) else (cache.hits, cache.misses)
+
+    result, error = _worker._rewrite_one(filename)
+
+    # None if the cache was not checked for this file
+    cache_hit = None
+    if (cache is not None) and ((cache.hits, cache.misses) != counts):
+        cache_hit = cache.hits > counts[0]
+
+    return filename, result, error, cache_hit
+
+
+def rewrite_parallel(args, config_data, jobs, filenames=None, include_args=[],
+                     compile_commands=None):
+    """
+    Rewrite all files named in filenames (default is args.filename) using a pool
+    of worker processes. filenames can be any iterable, e.g. a generator, and
+    files are handed to the workers as they are generated.
+    Output is printed in the same order that the files were given in. As with
+    CodeRewriter.rewrite, errors in one file do not stop other files from being
+    rewritten; errors are reported for each failed file, and 1 is returned if
+    any failed (or, with --check, if any file needs changes).
+    """
+    failed = 0
+    num_changed = 0
+
+    # Used to build the shared PCH, to total up cache hits/misses and stats from
+    # the workers, and to prune the cache
+    rewriter = CodeRewriter(args, config_data, filenames=[], include_args=include_args,
+                            compile_commands=compile_commands)
+
+    if filenames is None:
+        filenames = args.filename
+
+    filenames = rewriter._prepare_pch(filenames)
+
+    try:
+        with multiprocessing.Pool(jobs, initializer=_init_worker,
+                                  initargs=(args, config_data, include_args,
+                                            compile_commands, rewriter.pch)) as pool:
+            results = pool.imap(_rewrite_worker, filenames)
+            for filename, result, error, cache_hit, stats, trace_events in results:
+                if stats is not None:
+                    rewriter.stats.merge(stats)
+
+                if trace_events is not None:
+                    rewriter.trace.add_events(trace_events)
+
+                if cache_hit is not None:
+                    if cache_hit:
+                        rewriter.cache.hits += 1
+                    else:
+                        rewriter.cache.misses += 1
+
+                if error is not None:
+                    print(error)
+                    failed += 1
+                else:
+                    changed, output = result
+                    sys.stdout.write(output)
+                    num_changed += changed
+    finally:
+        rewriter._close_pch()
+
+    rewriter.finish()
+
+    if args.check:
+        sys.stderr.write(check_summary(num_changed) + "\n")
+        if num_changed:
+            return 1
+
+    return 1 if failed else 0
@@ -4,17 +4,19 @@ from lintern.cfile import CodeRewriteRule, CodeChunkReplacement
 from lintern.utils import (
         original_text_from_tokens, find_statement_beginning_index,
         builtin_signed_type_names, builtin_unsigned_type_names, builtin_type_names,
-        default_value_for_type, get_line_indent, get_configured_indent,find_last_matching_rparen,
+        default_value_for_type, get_configured_indent, find_last_matching_rparen,
         find_last_matching_rbrace, find_next_toplevel_semicolon_index
 )
 
 
-def add_semicolon_if_required(index, tokens, subtoks):
-    if (subtoks[-1].kind != TokenKind.PUNCTUATION) or (subtoks[-1].spelling != ';'):
-        if (index + len(subtoks)) < len(tokens):
-            nexttok = tokens[index + len(subtoks)]
-            if (nexttok.kind == TokenKind.PUNCTUATION) and (nexttok.spelling == ';'):
-                subtoks.append(nexttok)
+def add_semicolon_if_required(tokens, start, end):
+    # Returns the end of the given token range, extended to include the next
+    # token if it's a semicolon that isn't already included
+    if not tokens.is_punctuation(end - 1, ';'):
+        if (end < len(tokens)) and tokens.is_punctuation(end, ';'):
+            return end + 1
+
+    return end
 
 
 class BracesAroundCodeBlocks(CodeRewriteRule):
@@ -49,158 +51,146 @@ Becomes:
     }
 
     """
+    token_kinds = {TokenKind.KEYWORD}
+    cursor_kinds = {CursorKind.DO_STMT, CursorKind.WHILE_STMT, CursorKind.FOR_STMT}
+
     def __init__(self):
         super(BracesAroundCodeBlocks, self).__init__()
         self.tokens = 0
-        self.last_cursor_kind = None
 
-    def _code_block_after_conditional(self, rewriter, index, tokens, text):
+    def _code_block_after_conditional(self, rewriter, index, tokens, start, end, text):
         # Find the closing paren. of conditional statement
-        start_index = find_last_matching_rparen(tokens)
+        body_index = find_last_matching_rparen(tokens, start, end)
 
-        if start_index is None:
+        if (body_index is None) or (body_index >= end):
             return None
 
-        if tokens[start_index].kind == TokenKind.PUNCTUATION:
-            if tokens[start_index].spelling == '{':
-                # Statement is already using braces.
-                return None
+        if tokens.is_punctuation(body_index, '{'):
+            # Statement is already using braces.
+            return None
 
-        end_index = find_next_toplevel_semicolon_index(tokens) + 1
+        end_index = find_next_toplevel_semicolon_index(tokens, start, end)
         if end_index is None:
             return None
 
-        tokens = tokens[:end_index]
-        origindent = get_line_indent(tokens[0], text)
+        origindent = rewriter.lines.indent(tokens.start(start))
         indent = get_configured_indent(rewriter.config)
 
-        newtext = original_text_from_tokens(tokens[:start_index], text)
+        newtext = original_text_from_tokens(tokens, start, body_index, text)
         newtext += "\n" + origindent + "{"
-        newtext += "\n" + (origindent + indent) + original_text_from_tokens(tokens[start_index:], text)
+        newtext += ("\n" + (origindent + indent) +
+                    original_text_from_tokens(tokens, body_index, end_index + 1, text))
         newtext += "\n" + origindent + "}"
 
 
         ret = CodeChunkReplacement(index,
-                                   tokens[0].extent.start.offset,
-                                   tokens[-1].extent.end.offset,
+                                   tokens.start(start),
+                                   tokens.end(end_index),
                                    newtext)
 
         return ret
 
-    def rewrite_do_stmt(self, rewriter, index, tokens, text):
-        toks = list(tokens[index].cursor.get_tokens())
+    def rewrite_do_stmt(self, rewriter, entry, tokens, text):
+        start = entry.start
+        end = entry.end
 
-        if (toks[1].kind == TokenKind.PUNCTUATION) and (toks[1].spelling == '{'):
+        if tokens.is_punctuation(start + 1, '{'):
             # Do statement is already using braces
             return None
 
         # Find while statement at the end
         end_index = None
-        for i in range(len(toks)):
-            tok = toks[i]
-            if (tok.kind == TokenKind.PUNCTUATION) and (tok.spelling == ';'):
+        for i in range(start, end):
+            if tokens.is_punctuation(i, ';'):
                 end_index = i
                 break
 
         if end_index is None:
             return None
 
-        toks = toks[:end_index + 1]
-
-        origindent = get_line_indent(toks[0], text)
+        origindent = rewriter.lines.indent(tokens.start(start))
         indent = get_configured_indent(rewriter.config)
 
-        newtext = toks[0].spelling
+        newtext = tokens.spelling(start)
         newtext += "\n" + origindent + "{"
-        newtext += "\n" + (origindent + indent) + original_text_from_tokens(toks[1:], text)
+        newtext += ("\n" + (origindent + indent) +
+                    original_text_from_tokens(tokens, start + 1, end_index + 1, text))
         newtext += "\n" + origindent + "}"
 
-        ret = CodeChunkReplacement(index,
-                                   toks[0].extent.start.offset,
-                                   toks[-1].extent.end.offset,
+        ret = CodeChunkReplacement(start,
+                                   tokens.start(start),
+                                   tokens.end(end_index),
                                    newtext)
 
         return ret
 
-    def rewrite_while_stmt(self, rewriter, index, tokens, text):
-        if self.last_cursor_kind == CursorKind.DO_STMT:
-            # This is the 'while' part of a do-while statement, no braces to add
-            return None
-
-        toks = list(tokens[index].cursor.get_tokens())
-        add_semicolon_if_required(index, tokens, toks)
-        return self._code_block_after_conditional(rewriter, index, toks, text)
+    def rewrite_while_stmt(self, rewriter, entry, tokens, text):
+        # No need to check for the 'while' part of a do-while statement here;
+        # the 'while' token belongs to the DO_STMT cursor, so it never starts
+        # a WHILE_STMT cursor
+        end = add_semicolon_if_required(tokens, entry.start, entry.end)
+        return self._code_block_after_conditional(rewriter, entry.start, tokens,
+                                                  entry.start, end, text)
 
-    def rewrite_for_stmt(self, rewriter, index, tokens, text):
-        toks = list(tokens[index].cursor.get_tokens())
-        add_semicolon_if_required(index, tokens, toks)
-        return self._code_block_after_conditional(rewriter, index, toks, text)
+    def rewrite_for_stmt(self, rewriter, entry, tokens, text):
+        end = add_semicolon_if_required(tokens, entry.start, entry.end)
+        return self._code_block_after_conditional(rewriter, entry.start, tokens,
+                                                  entry.start, end, text)
 
     def check_rewrite_ifelse_stmt(self, rewriter, index, tokens, text):
-        tok = tokens[index]
-        if tok.kind != TokenKind.KEYWORD:
+        if tokens.kind(index) != TokenKind.KEYWORD:
             return None
 
-        if tok.spelling == 'if':
-            return self._code_block_after_conditional(rewriter, index, tokens[index:], text)
-        elif tok.spelling == 'else':
+        spelling = tokens.spelling(index)
+        if spelling == 'if':
+            return self._code_block_after_conditional(rewriter, index, tokens, index,
+                                                      len(tokens), text)
+        elif spelling == 'else':
             if index < (len(tokens) - 1):
-                if ((tokens[index + 1].kind == TokenKind.KEYWORD) and
-                    (tokens[index + 1].spelling == 'if')):
-                    return self._code_block_after_conditional(rewriter, index, tokens[index:], text)
+                if tokens.is_keyword(index + 1, 'if'):
+                    return self._code_block_after_conditional(rewriter, index, tokens, index,
+                                                              len(tokens), text)
 
-                elif ((tokens[index + 1].kind == TokenKind.PUNCTUATION) and
-                      (tokens[index + 1].spelling == '{')):
+                elif tokens.is_punctuation(index + 1, '{'):
                     # Statement is already using braces
                     return None
 
                 else:
-                    toks = tokens[index:]
-                    end_index = find_next_toplevel_semicolon_index(toks) + 1
+                    end_index = find_next_toplevel_semicolon_index(tokens, index)
                     if end_index is None:
                         return None
 
-                    toks = toks[:end_index]
-
-                    origindent = get_line_indent(toks[0], text)
+                    origindent = rewriter.lines.indent(tokens.start(index))
                     indent = get_configured_indent(rewriter.config)
 
-                    newtext = toks[0].spelling
+                    newtext = tokens.spelling(index)
                     newtext += "\n" + origindent + "{"
                     newtext += ("\n" + (origindent + indent) +
-                                original_text_from_tokens(toks[1:], text))
+                                original_text_from_tokens(tokens, index + 1, end_index + 1, text))
                     newtext += "\n" + origindent + "}"
 
                     ret = CodeChunkReplacement(index,
-                                               toks[0].extent.start.offset,
-                                               toks[-1].extent.end.offset,
+                                               tokens.start(index),
+                                               tokens.end(end_index),
                                                newtext)
                     return ret
 
         return None
 
     def consume_token(self, rewriter, index, tokens, text):
-        token = tokens[index]
-        ret = None
-
-        ret = self.check_rewrite_ifelse_stmt(rewriter, index, tokens, text)
-        if ret:
-            return ret
+        return self.check_rewrite_ifelse_stmt(rewriter, index, tokens, text)
 
-        if token.cursor.kind == CursorKind.DO_STMT:
-            ret = self.rewrite_do_stmt(rewriter, index, tokens, text)
+    def consume_cursor(self, rewriter, entry, tokens, text):
+        if entry.kind == CursorKind.DO_STMT:
+            return self.rewrite_do_stmt(rewriter, entry, tokens, text)
 
-        elif token.cursor.kind == CursorKind.WHILE_STMT:
-            ret = self.rewrite_while_stmt(rewriter, index, tokens, text)
+        elif entry.kind == CursorKind.WHILE_STMT:
+            return self.rewrite_while_stmt(rewriter, entry, tokens, text)
 
-        elif token.cursor.kind == CursorKind.FOR_STMT:
-            ret = self.rewrite_for_stmt(rewriter, index, tokens, text)
+        elif entry.kind == CursorKind.FOR_STMT:
+            return self.rewrite_for_stmt(rewriter, entry, tokens, text)
 
-        self.last_cursor_kind = token.cursor.kind
-        return ret
-
-    def reset(self):
-        self.last_cursor_kind = None
+        return None
 
 
 class PrototypeFunctionDeclarations(CodeRewriteRule):
@@ -231,44 +221,41 @@ Becomes:
     }
 
     """
+    cursor_kinds = {CursorKind.FUNCTION_DECL}
+
     def __init__(self):
         super(PrototypeFunctionDeclarations, self).__init__()
         self.tokens = 0
 
-    def consume_token(self, rewriter, index, tokens, text):
-        token = tokens[index]
-        if token.cursor.kind == CursorKind.FUNCTION_DECL:
-            decl_toks = [t for t in token.cursor.get_tokens()]
-
-            # Find opening paren of param declarations
-            lparen_index = None
-            for i in range(len(decl_toks)):
-                t = decl_toks[i]
-                if (t.kind == TokenKind.PUNCTUATION) and (t.spelling == '('):
-                    lparen_index = i
-                    break
+    def consume_cursor(self, rewriter, entry, tokens, text):
+        start = entry.start
+        end = entry.end
 
-            if lparen_index is None:
-                return
+        # Find opening paren of param declarations
+        lparen_index = None
+        for i in range(start, end):
+            if tokens.is_punctuation(i, '('):
+                lparen_index = i
+                break
 
-            if lparen_index >= len(decl_toks):
-                return None
+        if lparen_index is None:
+            return None
 
-            if ((decl_toks[lparen_index + 1].kind != TokenKind.PUNCTUATION) or
-                (decl_toks[lparen_index + 1].spelling != ')')):
-                # Already has something in the parameter declaration
-                return None
+        if (lparen_index + 1) >= end:
+            return None
 
-            decl_toks = decl_toks[:lparen_index + 2]
+        if not tokens.is_punctuation(lparen_index + 1, ')'):
+            # Already has something in the parameter declaration
+            return None
 
-            newtext = original_text_from_tokens(decl_toks[:-1], text)
-            newtext += "void)"
+        newtext = original_text_from_tokens(tokens, start, lparen_index + 1, text)
+        newtext += "void)"
 
-            ret = CodeChunkReplacement(index,
-                                       decl_toks[0].extent.start.offset,
-                                       decl_toks[-1].extent.end.offset,
-                                       newtext)
-            return ret
+        ret = CodeChunkReplacement(start,
+                                   tokens.start(start),
+                                   tokens.end(lparen_index + 1),
+                                   newtext)
+        return ret
 
 
 class InitializeCanonicals(CodeRewriteRule):
@@ -293,14 +280,22 @@ Becomes:
     short *z = NULL;
 
     """
+    token_kinds = {TokenKind.PUNCTUATION}
+    cursor_kinds = {CursorKind.VAR_DECL}
+
     def __init__(self):
         super(InitializeCanonicals, self).__init__()
         self.depth = 0
 
+        # (start, end) token indices of the last declaration statement that was
+        # looked at. A statement declaring several variables has a VAR_DECL
+        # cursor for each one, but only needs to be rewritten once.
+        self.statement = None
+
     def rewrite_var_decl(self, rewriter, index, startindex, endindex, tokens, text):
         typeindex = None
         for i in range(startindex, endindex, 1):
-            if tokens[i].spelling in builtin_type_names:
+            if tokens.spelling(i) in builtin_type_names:
                 typeindex = i
                 break
 
@@ -308,62 +303,62 @@ Becomes:
             return None
 
         varindex = typeindex + 1
-        if tokens[typeindex].spelling == 'unsigned':
-            if tokens[varindex].spelling in builtin_type_names:
+        if tokens.spelling(typeindex) == 'unsigned':
+            if tokens.spelling(varindex) in builtin_type_names:
                 varindex += 1
 
-        decls_only = tokens[varindex:endindex + 1]
-        toks = tokens[startindex:endindex + 1]
         decls = []
-        declbuf = []
+        declstart = varindex
+        declend = varindex
         inits_needed = 0
         bdepth = 0
         pdepth = 0
         is_pointer = False
         needs_init = True
 
-        for i in range(len(decls_only)):
-            tok = decls_only[i]
-            if tok.kind == TokenKind.PUNCTUATION:
-                if (pdepth == 0) and (bdepth == 0) and (tok.spelling in [',', ';']):
+        for i in range(varindex, endindex + 1):
+            spelling = tokens.spelling(i)
+            if tokens.kind(i) == TokenKind.PUNCTUATION:
+                if (pdepth == 0) and (bdepth == 0) and (spelling in [',', ';']):
                     if needs_init:
                         inits_needed += 1
 
-                    decls.append((needs_init, is_pointer, declbuf))
+                    decls.append((needs_init, is_pointer, declstart, declend))
                     is_pointer = False
                     needs_init = True
-                    declbuf = []
+                    declstart = i + 1
+                    declend = i + 1
 
-                elif tok.spelling == '(':
+                elif spelling == '(':
                     pdepth += 1
-                    declbuf.append(tok)
+                    declend = i + 1
 
-                elif tok.spelling == ')':
+                elif spelling == ')':
                     pdepth -= 1
-                    declbuf.append(tok)
+                    declend = i + 1
 
-                elif tok.spelling == '{':
+                elif spelling == '{':
                     bdepth += 1
-                    declbuf.append(tok)
+                    declend = i + 1
 
-                elif tok.spelling == '}':
+                elif spelling == '}':
                     bdepth -= 1
-                    declbuf.append(tok)
+                    declend = i + 1
 
-                elif tok.spelling == '*':
+                elif spelling == '*':
                     is_pointer = True
-                    declbuf.append(tok)
+                    declend = i + 1
 
                 else:
-                    declbuf.append(tok)
+                    declend = i + 1
 
             else:
-                declbuf.append(tok)
+                declend = i + 1
 
-            if tok.spelling in ['=', '[']:
+            if spelling in ['=', '[']:
                 needs_init = False
 
-        if not decls or not decls[0]:
+        if not decls:
             return None
 
         if inits_needed == 0:
@@ -371,48 +366,49 @@ Becomes:
             return None
 
         newdecls = []
-        for needs_init, is_pointer, decl in decls:
+        for needs_init, is_pointer, declstart, declend in decls:
             # Check if already initialized
-            newtext = original_text_from_tokens(decl, text)
+            newtext = original_text_from_tokens(tokens, declstart, declend, text)
 
             if needs_init:
                 if is_pointer:
                     value = 'NULL'
                 else:
-                    value = default_value_for_type(tokens[typeindex].spelling)
+                    value = default_value_for_type(tokens.spelling(typeindex))
 
                 newtext += " = %s" % value
 
             newdecls.append(newtext)
 
-        newtext = original_text_from_tokens(tokens[startindex:varindex], text) + ' '
+        newtext = original_text_from_tokens(tokens, startindex, varindex, text) + ' '
         newtext += ', '.join(newdecls) + ";"
 
         ret = CodeChunkReplacement(index,
-                                   tokens[startindex].extent.start.offset,
-                                   tokens[endindex].extent.end.offset,
+                                   tokens.start(startindex),
+                                   tokens.end(endindex),
                                    newtext)
 
         return ret
 
     def reset(self):
         self.depth = 0
+        self.statement = None
 
     def consume_token(self, rewriter, index, tokens, text):
-        tok = tokens[index]
+        spelling = tokens.spelling(index)
+        if spelling == '(':
+            self.depth += 1
+        elif spelling == ')':
+            self.depth -= 1
 
-        if tok.kind == TokenKind.PUNCTUATION:
-            if tok.spelling == '(':
-                self.depth += 1
-            elif tok.spelling == ')':
-                self.depth -= 1
+        return None
 
+    def consume_cursor(self, rewriter, entry, tokens, text):
+        if self.depth != 0:
             return None
 
-        elif (tok.cursor.kind != CursorKind.VAR_DECL) or (self.depth != 0):
-            return None
+        index = entry.start
 
-        #print(tok.cursor.kind, ' '.join([t.spelling for t in tok.cursor.get_tokens()]))
         # Find statement beginning
         startindex = find_statement_beginning_index(tokens, index)
 
@@ -421,6 +417,10 @@ Becomes:
         if not endindex:
             return None
 
+        if self.statement == (startindex, endindex):
+            return None
+
+        self.statement = (startindex, endindex)
         return self.rewrite_var_decl(rewriter, index, startindex, endindex, tokens, text)
 
 
@@ -460,101 +460,99 @@ Becomes:
     def tokens_buffered(self):
         return self.tokens
 
-    def replacement_code(self, tokens, text):
-        subtoks = tokens[self.start_index:self.end_index + 1]
-        typename = subtoks[0].spelling
-        typeend = 1
-
-        if typename == 'unsigned':
-            if subtoks[1].kind == TokenKind.KEYWORD:
-                typename = '%s %s' % (typename, subtoks[1].spelling)
-                typeend = 2
+    def replacement_code(self, rewriter, tokens, text):
+        # The type is every keyword up to the first declarator, e.g. all of
+        # 'unsigned long long' or 'int const'
+        typeend = self.start_index + 1
+        while (typeend < self.end_index) and (tokens.kind(typeend) == TokenKind.KEYWORD):
+            typeend += 1
 
         firsttok_index = find_statement_beginning_index(tokens, self.start_index)
-        firsttok = tokens[firsttok_index]
-        fulltype = text[firsttok.extent.start.offset:subtoks[0].extent.start.offset] + typename
+        firsttok_offset = tokens.start(firsttok_index)
+        fulltype = original_text_from_tokens(tokens, firsttok_index, typeend, text)
 
         # Group tokens between commas, starting from the first ID
         groups = []
-        buf = []
-        for i in range(typeend, len(subtoks), 1): # First ID is index 1
-            tok = subtoks[i]
-            if (tok.kind == TokenKind.PUNCTUATION) and (tok.spelling in [',', ';']):
-                groups.append(buf)
-                buf = []
-            else:
-                buf.append(tok)
+        groupstart = typeend
+        for i in range(typeend, self.end_index + 1, 1):
+            if (tokens.kind(i) == TokenKind.PUNCTUATION) and (tokens.spelling(i) in [',', ';']):
+                groups.append((groupstart, i))
+                groupstart = i + 1
 
         lines = []
-        for g in groups:
-            origtext = original_text_from_tokens(g, text)
+        for start, end in groups:
+            origtext = original_text_from_tokens(tokens, start, end, text)
             lines.append("%s %s;" % (fulltype, origtext))
 
-        indent = get_line_indent(firsttok, text)
+        indent = rewriter.lines.indent(firsttok_offset)
         newtext = ("\n%s" % indent).join(lines)
 
         ret = CodeChunkReplacement(self.start_index,
-                                   firsttok.extent.start.offset,
-                                   subtoks[-1].extent.end.offset,
+                                   firsttok_offset,
+                                   tokens.end(self.end_index),
                                    newtext)
 
         return ret
 
     def reset(self):
+        self.state = self.STATE_START
         self.depth = 0
         self.commas = 0
 
     def consume_token(self, rewriter, index, tokens, text):
-        token = tokens[index]
+        kind = tokens.kind(index)
+        spelling = tokens.spelling(index)
         ret = None
 
         if self.state == self.STATE_START:
             self.tokens = 0
 
-            if (token.kind == TokenKind.KEYWORD) and (token.spelling in builtin_type_names):
-                if token.cursor.kind not in [CursorKind.PARM_DECL, CursorKind.FUNCTION_DECL]:
+            if (kind == TokenKind.KEYWORD) and (spelling in builtin_type_names):
+                if tokens.cursor_kind(index) not in [CursorKind.PARM_DECL, CursorKind.FUNCTION_DECL]:
                     self.start_index = index
                     self.state = self.STATE_ID
 
         elif self.state == self.STATE_ID:
-            if (token.kind == TokenKind.KEYWORD) and (token.spelling in builtin_type_names):
+            if (kind == TokenKind.KEYWORD) and (spelling in builtin_type_names):
                 pass
-            elif token.kind == TokenKind.IDENTIFIER:
+            elif kind == TokenKind.IDENTIFIER:
                 self.state = self.STATE_EQUALS
-            elif token.kind == TokenKind.PUNCTUATION:
-                if token.spelling != "*":
+            elif kind == TokenKind.PUNCTUATION:
+                if spelling != "*":
                     self.state = self.STATE_START
-            elif token.kind == TokenKind.KEYWORD:
-                if token.spelling not in ['const', 'volatile']:
+            elif kind == TokenKind.KEYWORD:
+                if spelling not in ['const', 'volatile']:
                     self.state = self.STATE_START
             else:
                 self.state = self.STATE_START
 
         elif self.state == self.STATE_EQUALS:
-            if token.kind == TokenKind.PUNCTUATION:
-                if token.spelling == '=':
+            if kind == TokenKind.PUNCTUATION:
+                if spelling == '=':
                     self.state = self.STATE_VALUES
-                elif token.spelling == ',':
+                elif spelling == ',':
                     self.commas += 1
                     self.state = self.STATE_VALUES
+                elif spelling == ';':
+                    # Single declaration, nothing to split
+                    self.reset()
             else:
                 self.state = self.STATE_START
 
         elif self.state == self.STATE_VALUES:
-            if token.kind == TokenKind.PUNCTUATION:
-                if token.spelling == ';':
+            if kind == TokenKind.PUNCTUATION:
+                if spelling == ';':
                     if self.commas > 0:
                         self.end_index = index
-                        ret = self.replacement_code(tokens, text)
+                        ret = self.replacement_code(rewriter, tokens, text)
 
-                    self.state = self.STATE_START
-                    self.commas = 0
+                    self.reset()
 
-                elif token.spelling == '(':
+                elif spelling == '(':
                     self.depth += 1
-                elif token.spelling == ')':
+                elif spelling == ')':
                     self.depth -= 1
-                elif (self.depth == 0) and (token.spelling == ','):
+                elif (self.depth == 0) and (spelling == ','):
                     self.commas += 1
 
         if (self.state != self.STATE_START):
@@ -598,22 +596,19 @@ Becomes:
     }
 
     """
+    cursor_kinds = {CursorKind.IF_STMT}
 
-    def rewrite_if_stmt(self, rewriter, index, tokens, text):
+    def rewrite_if_stmt(self, rewriter, index, tokens, start, end, text):
         # Check if there are else-if clauses but a missing else clause
         has_else = False
         has_elseif = False
 
-        for i in range(len(tokens)):
-            t = tokens[i]
-            if t.kind == TokenKind.KEYWORD:
-                if t.spelling == 'else':
-                    if ((i < (len(tokens) - 1)) and
-                        (tokens[i + 1].kind == TokenKind.KEYWORD) and
-                        (tokens[i + 1].spelling == 'if')):
-                        has_elseif = True
-                    else:
-                        has_else = True
+        for i in range(start, end):
+            if tokens.is_keyword(i, 'else'):
+                if (i < (end - 1)) and tokens.is_keyword(i + 1, 'if'):
+                    has_elseif = True
+                else:
+                    has_else = True
 
         # If statement already has an 'else' clause, or if statement
         # has no else-if clause, no rewrite needed.
@@ -621,27 +616,25 @@ Becomes:
             return None
 
         # No else clause, we need to add one.
-        origindent = get_line_indent(tokens[0], text)
+        origindent = rewriter.lines.indent(tokens.start(start))
         indent = get_configured_indent(rewriter.config)
 
-        newtext = original_text_from_tokens(tokens, text)
+        newtext = original_text_from_tokens(tokens, start, end, text)
         newtext += "\n" + origindent + "else"
         newtext += "\n" + origindent + "{"
         newtext += "\n" + origindent + indent + ";"
         newtext += "\n" + origindent + "}"
 
         ret = CodeChunkReplacement(index,
-                                   tokens[0].extent.start.offset,
-                                   tokens[-1].extent.end.offset,
+                                   tokens.start(start),
+                                   tokens.end(end - 1),
                                    newtext)
 
         return ret
 
-    def consume_token(self, rewriter, index, tokens, text):
-        if tokens[index].cursor.kind == CursorKind.IF_STMT:
-            toks = list(tokens[index].cursor.get_tokens())
-            add_semicolon_if_required(index, tokens, toks)
-            return self.rewrite_if_stmt(rewriter, index, toks, text)
+    def consume_cursor(self, rewriter, entry, tokens, text):
+        end = add_semicolon_if_required(tokens, entry.start, entry.end)
+        return self.rewrite_if_stmt(rewriter, entry.start, tokens, entry.start, end, text)
 
 
 class ExplicitUnusedFunctionParams(CodeRewriteRule):
@@ -669,38 +662,32 @@ Becomes:
         return b + 2;
     }
     """
+    cursor_kinds = {CursorKind.FUNCTION_DECL}
+    parameter_uses = True
 
-    def rewrite_func_impl(self, paramnames, rewriter, index, tokens, text):
+    def rewrite_func_impl(self, params, rewriter, index, tokens, start, end, text):
         # Find opening brace
         lbrace_index = None
-        for i in range(len(tokens)):
-            tok = tokens[i]
-            if (tok.kind == TokenKind.PUNCTUATION) and (tok.spelling == '{'):
+        for i in range(start, end):
+            if tokens.is_punctuation(i, '{'):
                 lbrace_index = i
                 break
 
         if lbrace_index is None:
             return None
 
-        # Now, count no. of references of each param within the function body
-        refs = {n: 0 for n in paramnames}
-        for i in range(lbrace_index, len(tokens), 1):
-            tok = tokens[i]
-            if tok.kind == TokenKind.IDENTIFIER:
-                if tok.spelling in refs:
-                    refs[tok.spelling] += 1
-
+        # Unnamed parameters can't be referenced, so leave those alone
         not_used = []
-        for n in refs:
-            if refs[n] == 0:
-                not_used.append(n)
+        for p in params:
+            if p.displayname and (rewriter.cursors.uses(p) == 0):
+                not_used.append(p.displayname)
 
         if not not_used:
             # All params are referenced
             return None
 
         # Get indent from current first line of function body
-        indent = get_line_indent(tokens[lbrace_index + 1], text)
+        indent = rewriter.lines.indent(tokens.start(lbrace_index + 1))
         bodyempty = (indent == '')
 
         newtext = ""
@@ -715,20 +702,17 @@ Becomes:
             newtext += "\n"
 
         ret = CodeChunkReplacement(index,
-                                   tokens[lbrace_index + 1].extent.start.offset,
-                                   tokens[lbrace_index].extent.end.offset,
+                                   tokens.start(lbrace_index + 1),
+                                   tokens.end(lbrace_index),
                                    newtext)
 
         return ret
 
-    def consume_token(self, rewriter, index, tokens, text):
-        if tokens[index].cursor.kind == CursorKind.FUNCTION_DECL:
-            paramnames = [a.displayname for a in list(tokens[index].cursor.get_arguments())]
-            if not paramnames:
-                # No function params
-                return None
-
-            toks = list(tokens[index].cursor.get_tokens())
-            return self.rewrite_func_impl(paramnames, rewriter, index, toks, text)
+    def consume_cursor(self, rewriter, entry, tokens, text):
+        params = list(entry.cursor.get_arguments())
+        if not params:
+            # No function params
+            return None
 
-        return None
+        return self.rewrite_func_impl(params, rewriter, entry.start, tokens,
+                                      entry.start, entry.end, text)
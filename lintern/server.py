@@ -0,0 +1,177 @@
+import os
+import sys
+import signal
+import socket
+import argparse
+import traceback
+
+import clang.cindex
+from clang.cindex import TranslationUnitLoadError
+
+from lintern.config import verify_config_data
+from lintern.cfile import ParsedFileCache
+from lintern.client import send_message, recv_message
+from lintern.rewriter import CodeRewriter
+
+
+class LinternServer(object):
+    """
+    Rewrites files on request from LinternClient instances, over a Unix socket.
+    Requests are handled one at a time. Between requests, the server keeps the
+    libclang index, system include directories and compile commands, and also
+    keeps the translation units of the most recently used files alive, so that
+    rewriting a file again after a small edit only needs to re-parse the file
+    itself, using its precompiled preamble, rather than all of its headers.
+    """
+    MAX_FILES = 32
+
+    def __init__(self, socket_path, args, include_args=[], compile_commands=None,
+                 max_files=MAX_FILES):
+        self.socket_path = socket_path
+        self.include_args = include_args
+        self.compile_commands = compile_commands
+        self.index = clang.cindex.Index.create()
+
+        # Stats, tracing and the result cache are per-run options, which don't
+        # make sense for a long-running server
+        self.args = argparse.Namespace(**vars(args))
+        self.args.stats = False
+        self.args.trace = None
+        self.args.cache_dir = None
+
+        self._files = ParsedFileCache(self.index, ignore_errors=self.args.ignore_errors,
+                                      max_files=max_files)
+
+        # CodeRewriter instances, keyed by configuration
+        self._rewriters = {}
+
+    def _rewriter(self, config_data, indent_type, indent_level):
+        key = (tuple(sorted(config_data.items())), indent_type, indent_level)
+
+        ret = self._rewriters.get(key)
+        if ret is None:
+            args = argparse.Namespace(**vars(self.args))
+            args.indent_type = indent_type
+            args.indent_level = indent_level
+
+            ret = CodeRewriter(args, config_data, filenames=[], include_args=self.include_args,
+                               compile_commands=self.compile_commands)
+            ret.index = self.index
+            self._rewriters[key] = ret
+
+        return ret
+
+    def handle_request(self, request):
+        """
+        Rewrite a file, as described by a request message from LinternClient.
+        Returns the response message.
+        """
+        try:
+            filename = request['filename']
+            text = request['text']
+            config_data = request['config']
+            indent_type = request.get('indent_type', 'space')
+            indent_level = int(request.get('indent_level', 4))
+            ignore_errors = bool(request.get('ignore_errors', self.args.ignore_errors))
+        except (KeyError, TypeError, ValueError):
+            return {'error': "Malformed request"}
+
+        try:
+            if indent_type not in ['space', 'tab']:
+                return {'error': "Invalid indent type '%s'" % indent_type}
+
+            if not isinstance(config_data, dict):
+                return {'error': "Invalid configuration: expected an object, not '%s'"
+                                 % config_data}
+
+            result = verify_config_data(config_data)
+            if result is not None:
+                return {'error': "Invalid configuration: %s" % result}
+
+            return self._rewrite(filename, text, config_data, indent_type, indent_level,
+                                 ignore_errors)
+        except Exception as e:
+            # A bug in a rule (or in lintern), or a request that slipped past the
+            # checks above, should only fail this request, rather than taking
+            # down the server for every client after it
+            traceback.print_exc()
+            return {'error': "\nFile '%s' could not be rewritten: %s: %s\n"
+                             % (filename, e.__class__.__name__, e)}
+
+    def _rewrite(self, filename, text, config_data, indent_type, indent_level, ignore_errors):
+        rewriter = self._rewriter(config_data, indent_type, indent_level)
+
+        try:
+            parse_filename, compiler_args = rewriter._compiler_args_for(filename)
+            cf, success = self._files.load(parse_filename, text, compiler_args,
+                                           ignore_errors=ignore_errors)
+        except TranslationUnitLoadError as e:
+            return {'error': "\nFile '%s' could not be parsed: %s\n" % (filename, e)}
+
+        if not success:
+            return {'error': cf.error_report()}
+
+        new_file_content = rewriter._rewrite_file(cf)
+        if new_file_content is None:
+            return {'error': cf.error_report()}
+
+        return {'text': new_file_content}
+
+    def _serve_connection(self, conn):
+        while True:
+            try:
+                request = recv_message(conn)
+            except (OSError, ValueError):
+                return
+
+            if request is None:
+                return
+
+            send_message(conn, self.handle_request(request))
+
+    def _bind(self):
+        if os.path.exists(self.socket_path):
+            # Only remove the socket if no server is listening on it
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                os.unlink(self.socket_path)
+            else:
+                raise OSError("a lintern server is already listening on '%s'"
+                              % self.socket_path)
+            finally:
+                probe.close()
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # Only the current user should be able to connect
+        old_umask = os.umask(0o077)
+        try:
+            sock.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+
+        sock.listen(8)
+        return sock
+
+    def serve_forever(self):
+        """
+        Handle requests until interrupted, or terminated with SIGTERM
+        """
+        sock = self._bind()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        sys.stderr.write("lintern server listening on '%s'\n" % self.socket_path)
+
+        try:
+            while True:
+                conn, _ = sock.accept()
+                with conn:
+                    try:
+                        self._serve_connection(conn)
+                    except OSError:
+                        # Client went away
+                        pass
+        finally:
+            sock.close()
+            os.unlink(self.socket_path)
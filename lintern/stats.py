@@ -0,0 +1,211 @@
+import json
+
+
+class RuleStats(object):
+    """
+    Performance counters for a single rewrite rule, totalled over all files.
+    'proposed' is the number of replacements the rule generated, and 'applied'
+    is the number of those that were applied (the rest were dropped, mostly
+    because they overlapped another replacement). Both are counted per pass: a
+    dropped replacement is usually generated again by a later pass, and is then
+    counted as proposed again, so 'proposed' minus 'applied' is the number of
+    times a replacement had to wait for another pass, not the number of edits
+    that were never made.
+    """
+    __slots__ = ('name', 'time', 'tokens', 'cursors', 'proposed', 'applied')
+
+    def __init__(self, name):
+        self.name = name
+        self.time = 0.0
+        self.tokens = 0
+        self.cursors = 0
+        self.proposed = 0
+        self.applied = 0
+
+    def merge(self, other):
+        self.time += other.time
+        self.tokens += other.tokens
+        self.cursors += other.cursors
+        self.proposed += other.proposed
+        self.applied += other.applied
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'time': self.time,
+            'tokens': self.tokens,
+            'cursors': self.cursors,
+            'proposed': self.proposed,
+            'applied': self.applied
+        }
+
+
+class FileStats(object):
+    """
+    Performance counters for a single file. 'time' is the total wall time spent
+    on the file, 'parse_time' is the part of that spent in libclang parsing and
+    re-parsing it, and 'rule_time' is the part spent in the rules themselves.
+    'pch' is 'used' if the file was parsed with the shared PCH, 'fallback' if it
+    had to be parsed again without it, and None if it was not tried.
+    'proposed' and 'applied' are the numbers of replacements generated and
+    applied by all the rules, as in RuleStats.
+    """
+    __slots__ = ('filename', 'cached', 'pch', 'time', 'parse_time', 'rule_time', 'reparses',
+                 'passes', 'tokens', 'proposed', 'applied')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.cached = False
+        self.pch = None
+        self.time = 0.0
+        self.parse_time = 0.0
+        self.rule_time = 0.0
+        self.reparses = 0
+        self.passes = 0
+        self.tokens = 0
+        self.proposed = 0
+        self.applied = 0
+
+    def to_dict(self):
+        return {s: getattr(self, s) for s in self.__slots__}
+
+
+class RewriteStats(object):
+    """
+    Collects per-file and per-rule performance counters for the --stats option.
+    CodeRewriter only collects these when it has a RewriteStats instance, so
+    there is no cost when stats are disabled.
+    """
+    def __init__(self, rule_names):
+        self.rules = [RuleStats(name) for name in rule_names]
+        self.files = []
+        self._files_by_name = {}
+
+        # Time taken to parse the headers in the shared PCH, and to build it as
+        # a whole, if one was built
+        self.pch_parse_time = None
+        self.pch_build_time = None
+
+    def file(self, filename):
+        """
+        Returns the FileStats for the given file, creating it if necessary
+        """
+        ret = self._files_by_name.get(filename)
+        if ret is None:
+            ret = FileStats(filename)
+            self._files_by_name[filename] = ret
+            self.files.append(ret)
+
+        return ret
+
+    def merge(self, other):
+        """
+        Add counters collected by another RewriteStats instance (e.g. from a
+        worker process) to this one
+        """
+        for rule, other_rule in zip(self.rules, other.rules):
+            rule.merge(other_rule)
+
+        for f in other.files:
+            if f.filename not in self._files_by_name:
+                self._files_by_name[f.filename] = f
+                self.files.append(f)
+
+    def total(self):
+        """
+        Returns a FileStats with the counters for all files added together
+        """
+        ret = FileStats('total')
+        for f in self.files:
+            ret.time += f.time
+            ret.parse_time += f.parse_time
+            ret.rule_time += f.rule_time
+            ret.reparses += f.reparses
+            ret.passes += f.passes
+            ret.tokens += f.tokens
+            ret.proposed += f.proposed
+            ret.applied += f.applied
+
+        return ret
+
+    def pch_summary(self):
+        """
+        Returns a dict describing how the shared PCH was used, or None if one
+        was not built. The time saved is an estimate: each file that used the
+        PCH is assumed to have saved the time it took to parse the headers in
+        it, and the time taken to build the PCH is taken off.
+        """
+        if self.pch_build_time is None:
+            return None
+
+        used = len([f for f in self.files if f.pch == 'used'])
+        fallbacks = len([f for f in self.files if f.pch == 'fallback'])
+
+        return {
+            'build_time': self.pch_build_time,
+            'header_parse_time': self.pch_parse_time,
+            'files': used,
+            'fallbacks': fallbacks,
+            'time_saved': (used * self.pch_parse_time) - self.pch_build_time
+        }
+
+    def to_dict(self):
+        total = self.total().to_dict()
+        del total['filename']
+        del total['cached']
+        del total['pch']
+        total['files'] = len(self.files)
+
+        return {
+            'files': [f.to_dict() for f in self.files],
+            'rules': [r.to_dict() for r in self.rules],
+            'total': total,
+            'pch': self.pch_summary()
+        }
+
+    def format_table(self):
+        lines = []
+
+        name_width = max([len('file')] + [len(f.filename) for f in self.files])
+        row = "%%-%ds %%10s %%10s %%10s %%9s %%9s %%9s %%9s" % name_width
+        lines.append(row % ('file', 'time ms', 'parse ms', 'rules ms', 'reparses',
+                            'tokens', 'proposed', 'applied'))
+
+        for f in self.files + [self.total()]:
+            if f.cached:
+                lines.append(row % (f.filename, '%.1f' % (f.time * 1000.0),
+                                    '(cached)', '', '', '', '', ''))
+                continue
+
+            lines.append(row % (f.filename, '%.1f' % (f.time * 1000.0),
+                                '%.1f' % (f.parse_time * 1000.0),
+                                '%.1f' % (f.rule_time * 1000.0),
+                                f.reparses, f.tokens, f.proposed, f.applied))
+
+        name_width = max([len('rule')] + [len(r.name) for r in self.rules])
+        row = "%%-%ds %%10s %%9s %%9s %%9s %%9s" % name_width
+        lines.append('')
+        lines.append(row % ('rule', 'time ms', 'tokens', 'cursors', 'proposed', 'applied'))
+
+        for r in self.rules:
+            lines.append(row % (r.name, '%.1f' % (r.time * 1000.0), r.tokens, r.cursors,
+                                r.proposed, r.applied))
+
+        pch = self.pch_summary()
+        if pch is not None:
+            lines.append('')
+            lines.append("precompiled header: built in %.1f ms, used for %d files (%d "
+                         "parsed again without it), about %.1f ms saved"
+                         % (pch['build_time'] * 1000.0, pch['files'], pch['fallbacks'],
+                            pch['time_saved'] * 1000.0))
+
+        return '\n'.join(lines)
+
+    def report(self, fmt='text'):
+        """
+        Returns all counters as a table, or as JSON if fmt is 'json'
+        """
+        if fmt == 'json':
+            return json.dumps(self.to_dict(), indent=2)
+
+        return self.format_table()
@@ -0,0 +1,101 @@
+import os
+import json
+import shutil
+import tempfile
+
+import ccsyspath
+
+
+INCLUDE_PATHS_CACHE_FILENAME = 'include_paths.json'
+
+
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME')
+    if not cache_home:
+        cache_home = os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(cache_home, 'lintern')
+
+
+def _compiler_key(compiler_path):
+    # Identifies a specific build of a compiler, so that cached include paths are
+    # discarded when the compiler is upgraded or replaced. Returns None if the
+    # compiler can't be found.
+    found = shutil.which(compiler_path)
+    if found is None:
+        return None
+
+    realpath = os.path.realpath(found)
+
+    try:
+        st = os.stat(realpath)
+    except OSError:
+        return None
+
+    return '%s:%d:%d' % (realpath, st.st_mtime_ns, st.st_size)
+
+
+def _read_cache(path):
+    try:
+        with open(path, 'r') as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+    return data if isinstance(data, dict) else {}
+
+
+def _write_cache(path, data):
+    try:
+        cache_dir = os.path.dirname(path)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        fd, tmppath = tempfile.mkstemp(dir=cache_dir, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(data, fh, indent=2, sort_keys=True)
+
+            os.replace(tmppath, path)
+        except OSError:
+            os.unlink(tmppath)
+            raise
+    except OSError:
+        # Failing to write the cache is not fatal
+        pass
+
+
+def system_include_paths(compiler_path='clang', cache_dir=None):
+    """
+    Returns the system include directories of the given compiler. Finding them
+    means running the compiler, so the result is cached on disk, keyed by the
+    real path, modification time and size of the compiler binary.
+
+    :param str compiler_path: name or path of the compiler to query
+    :param str cache_dir: directory to cache include paths in. Default is \
+        $XDG_CACHE_HOME/lintern, or ~/.cache/lintern.
+
+    :return: list of include directories
+    """
+    key = _compiler_key(compiler_path)
+    if key is None:
+        # Let ccsyspath report the missing compiler
+        return [os.fsdecode(p) for p in ccsyspath.system_include_paths(compiler_path)]
+
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+
+    cache_path = os.path.join(cache_dir, INCLUDE_PATHS_CACHE_FILENAME)
+    cached = _read_cache(cache_path)
+
+    if key in cached:
+        return cached[key]
+
+    paths = [os.fsdecode(p) for p in ccsyspath.system_include_paths(compiler_path)]
+
+    # Keep entries for other compilers, but drop stale entries for this one
+    realpath = key.rsplit(':', 2)[0]
+    cached = {k: v for k, v in cached.items() if k.rsplit(':', 2)[0] != realpath}
+    cached[key] = paths
+    _write_cache(cache_path, cached)
+
+    return paths
@@ -0,0 +1,64 @@
+import os
+import json
+import time
+
+
+def trace_clock():
+    """
+    Returns the current time in seconds, from the same clock used for all trace
+    event timestamps (monotonic, and shared between processes)
+    """
+    return time.perf_counter()
+
+
+class TraceWriter(object):
+    """
+    Records spans of time as trace events, for the --trace option. Events are
+    written in the Chrome Trace Event Format, which can be opened with
+    chrome://tracing or https://ui.perfetto.dev. Spans are "complete" events,
+    which the trace viewer nests according to their start times and durations.
+    CodeRewriter only records events when it has a TraceWriter instance, so
+    there is no cost when tracing is disabled.
+    """
+    def __init__(self, process_name='lintern'):
+        self.pid = os.getpid()
+        self.events = [{
+            'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+            'args': {'name': '%s (%d)' % (process_name, self.pid)}
+        }]
+
+    def span(self, name, category, start, end, args=None):
+        """
+        Record a span of time
+
+        :param str name: name of the span
+        :param str category: category of the span, e.g. 'parse' or 'rule'
+        :param float start: start time, from trace_clock()
+        :param float end: end time, from trace_clock()
+        :param dict args: arguments to show with the span
+        """
+        event = {
+            'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid, 'tid': 0,
+            'ts': start * 1000000.0, 'dur': (end - start) * 1000000.0
+        }
+
+        if args is not None:
+            event['args'] = args
+
+        self.events.append(event)
+
+    def take_events(self):
+        """
+        Returns all events recorded so far, and forgets them (used to send events
+        from worker processes to the parent process as they are recorded)
+        """
+        ret = self.events
+        self.events = []
+        return ret
+
+    def add_events(self, events):
+        self.events.extend(events)
+
+    def write(self, filename):
+        with open(filename, 'w') as fh:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, fh)
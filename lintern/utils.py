@@ -1,6 +1,3 @@
-from clang.cindex import TokenKind
-
-
 builtin_unsigned_type_names = [
     'unsigned', 'unsigned int', 'uint8_t', 'uint16_t', 'uint32_t', 'uint64_t',
     'unsigned short', 'unsigned long', 'unsigned long long',
@@ -16,50 +13,24 @@ builtin_signed_type_names = [
 builtin_type_names = builtin_signed_type_names + builtin_unsigned_type_names
 
 
-def find_next_toplevel_semicolon_index(tokens, index=0):
-    end_index = None
-    depth = 0
-    i = index
-
-    while i < len(tokens):
-        tok = tokens[i]
-
-        if tok.kind == TokenKind.PUNCTUATION:
-            if tok.spelling == '(':
-                depth += 1
-            elif tok.spelling == ')':
-                depth -= 1
-            elif (depth == 0) and (tok.spelling == ';'):
-                end_index = i
-                break
-
-        i += 1
+def find_next_toplevel_semicolon_index(tokens, index=0, end=None):
+    if end is None:
+        end = len(tokens)
 
-    return end_index
+    return tokens.brackets.next_toplevel_semicolon(index, end)
 
 
-def find_last_matching_char(toks, pair=['(', ')']):
-    paren_depth = 0
+def find_last_matching_char(tokens, start, end, pair=['(', ')']):
+    i = tokens.brackets.matching_close(start, end, pair[0])
+    return None if i is None else i + 1
 
-    for i in range(len(toks)):
-        token = toks[i]
-        if (token.kind == TokenKind.PUNCTUATION) and (token.spelling == pair[0]):
-            paren_depth += 1
-        elif (token.kind == TokenKind.PUNCTUATION) and (token.spelling == pair[1]):
-            paren_depth -= 1
 
-            if paren_depth == 0:
-                return i + 1
+def find_last_matching_rparen(tokens, start, end):
+    return find_last_matching_char(tokens, start, end, pair=['(', ')'])
 
-    return None
 
-
-def find_last_matching_rparen(toks):
-    return find_last_matching_char(toks, pair=['(', ')'])
-
-
-def find_last_matching_rbrace(toks):
-    return find_last_matching_char(toks, pair=['{', '}'])
+def find_last_matching_rbrace(tokens, start, end):
+    return find_last_matching_char(tokens, start, end, pair=['{', '}'])
 
 
 def get_configured_indent(config):
@@ -67,21 +38,6 @@ def get_configured_indent(config):
     return indentchar * config.indent_level
 
 
-def get_line_indent(token, text):
-    i = token.extent.start.offset
-    ret = ""
-
-    while (i >= 0) and (text[i] != '\n'):
-        if text[i] in [' ', '\t', '\v']:
-            ret = text[i] + ret
-        else:
-            ret = ""
-
-        i -= 1
-
-    return ret
-
-
 def default_value_for_type(typename):
     if typename not in builtin_type_names:
         return None
@@ -100,29 +56,12 @@ def default_value_for_type(typename):
     return '0'
 
 
-def find_statement_beginning_index(tokenlist, index):
-    i = index
-
-    while i > 0:
-        t = tokenlist[i]
-        if (i < index) and (t.kind == TokenKind.COMMENT):
-            return i + 1
-
-        elif t.kind == TokenKind.PUNCTUATION:
-            if (i < index) and (t.spelling in ['{', '}', ';']):
-                return i + 1
+def find_statement_beginning_index(tokens, index):
+    return tokens.brackets.statement_start(index)
 
-        i -= 1
 
-    return index
-
-
-def original_text_from_tokens(tokenlist, text):
-    if not tokenlist:
+def original_text_from_tokens(tokens, start, end, text):
+    if start >= end:
         return ''
 
-    start = tokenlist[0].extent.start.offset
-    end = tokenlist[-1].extent.end.offset
-    return text[start:end]
-
-
+    return text[tokens.start(start):tokens.end(end - 1)]
@@ -0,0 +1,268 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+import clang.cindex
+from clang.cindex import TranslationUnitLoadError
+
+from lintern.cfile import ParsedFileCache
+from lintern.discover import GlobFilter, relative_path, walk_dirs, walk_files
+from lintern.output import handle_result
+from lintern.rewriter import CodeRewriter
+
+
+# Seconds to wait after the last change to a file before rewriting it, so that
+# editors which save a file in several steps only trigger one rewrite
+DEBOUNCE_SECONDS = 0.2
+
+# Seconds between scans of the directory tree, when inotify is not available
+POLL_INTERVAL_SECONDS = 1.0
+
+# Events from linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher(object):
+    """
+    Reports files that have been written or moved into a directory tree, using
+    inotify (via ctypes, to avoid extra dependencies). Only files selected by
+    glob_filter (a GlobFilter) are reported, and directories it excludes are
+    not watched. Raises OSError if inotify is not available.
+    """
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, root, glob_filter):
+        libc_name = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self._libc = libc
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self.root = root
+        self.glob_filter = glob_filter
+        self._paths = {}
+        self._add_tree(root)
+
+    def _add_tree(self, start):
+        for dirpath in walk_dirs(self.root, self.glob_filter, start):
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dirpath),
+                                              self.MASK | IN_ONLYDIR)
+            if wd >= 0:
+                self._paths[wd] = dirpath
+
+    def wait(self, timeout):
+        """
+        Wait for files to change
+
+        :param float timeout: maximum number of seconds to wait, or None to \
+            wait forever
+
+        :return: set of paths of files that changed (may be empty)
+        """
+        changed = set()
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return changed
+
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, name_len = _INOTIFY_EVENT.unpack_from(data, pos)
+            pos += _INOTIFY_EVENT.size
+            name = os.fsdecode(data[pos:pos + name_len].rstrip(b'\0'))
+            pos += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so assume everything changed
+                changed.update(walk_files(self.root, self.glob_filter))
+                continue
+
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+
+            dirpath = self._paths.get(wd)
+            if dirpath is None:
+                continue
+
+            path = os.path.join(dirpath, name)
+            relpath = relative_path(self.root, path)
+            if mask & IN_ISDIR:
+                # New directory; files may have been created in it before the
+                # watch was added
+                if not self.glob_filter.excludes_dir(relpath):
+                    self._add_tree(path)
+                    changed.update(walk_files(self.root, self.glob_filter, path))
+            elif ((mask & (IN_CLOSE_WRITE | IN_MOVED_TO))
+                  and self.glob_filter.includes_file(relpath)):
+                changed.add(path)
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """
+    Reports files that have changed in a directory tree, by periodically
+    comparing the modification time and size of every file selected by
+    glob_filter (a GlobFilter)
+    """
+    def __init__(self, root, glob_filter, interval=POLL_INTERVAL_SECONDS):
+        self.root = root
+        self.glob_filter = glob_filter
+        self.interval = interval
+        self._state = self._scan()
+
+    def _scan(self):
+        ret = {}
+        for path in walk_files(self.root, self.glob_filter):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            ret[path] = (st.st_mtime_ns, st.st_size)
+
+        return ret
+
+    def wait(self, timeout):
+        """
+        Wait for files to change
+
+        :param float timeout: maximum number of seconds to wait, or None to \
+            wait forever
+
+        :return: set of paths of files that changed (may be empty)
+        """
+        time.sleep(self.interval if timeout is None else min(self.interval, timeout))
+
+        state = self._scan()
+        changed = set(p for p in state if self._state.get(p) != state[p])
+        self._state = state
+        return changed
+
+    def close(self):
+        pass
+
+
+class WatchRewriter(object):
+    """
+    Rewrites files in a directory tree whenever they are saved. Translation units
+    of recently changed files are kept, so that rewriting a file again after an
+    edit only needs to re-parse it. The contents of each file after it was last
+    rewritten are remembered, so that lintern's own writes (and saves that don't
+    change anything) do not trigger another rewrite.
+    """
+    def __init__(self, args, config_data, include_args=[], compile_commands=None):
+        self.config = args
+        self.rewriter = CodeRewriter(args, config_data, filenames=[],
+                                     include_args=include_args,
+                                     compile_commands=compile_commands)
+        self.rewriter.index = clang.cindex.Index.create()
+        self.files = ParsedFileCache(self.rewriter.index, ignore_errors=args.ignore_errors)
+        self._last_text = {}
+
+    def rewrite_file(self, path):
+        try:
+            with open(path, 'r') as fh:
+                text = fh.read()
+        except OSError:
+            # Deleted or renamed since it changed
+            self._last_text.pop(path, None)
+            return
+        except ValueError as e:
+            print("\nFile '%s' could not be parsed: %s\n" % (path, e))
+            return
+
+        if self._last_text.get(path) == text:
+            return
+
+        parse_filename, compiler_args = self.rewriter._compiler_args_for(path)
+
+        try:
+            cf, success = self.files.load(parse_filename, text, compiler_args)
+        except TranslationUnitLoadError as e:
+            print("\nFile '%s' could not be parsed: %s\n" % (path, e))
+            return
+
+        if not success:
+            print(cf.error_report())
+            return
+
+        new_file_content = self.rewriter._rewrite_file(cf)
+        if new_file_content is None:
+            print(cf.error_report())
+            return
+
+        self._last_text[path] = new_file_content
+        if new_file_content == text:
+            return
+
+        changed, output = handle_result(self.config, path, text, new_file_content)
+        sys.stdout.write(output)
+        sys.stdout.flush()
+
+        if self.config.in_place and (not self.config.check):
+            sys.stderr.write("lintern: rewrote '%s'\n" % path)
+
+    def watch(self, root):
+        """
+        Rewrite files under the given directory as they change, until
+        interrupted. Files are selected with the --glob patterns, as for
+        directories given on the command line.
+        """
+        glob_filter = GlobFilter(self.config.globs)
+
+        try:
+            watcher = InotifyWatcher(root, glob_filter)
+        except OSError:
+            watcher = PollingWatcher(root, glob_filter)
+
+        sys.stderr.write("lintern: watching '%s' for changes\n" % root)
+
+        # Time of the last change to each file that has not been rewritten yet
+        pending = {}
+
+        try:
+            while True:
+                changed = watcher.wait(DEBOUNCE_SECONDS if pending else None)
+
+                now = time.monotonic()
+                for path in changed:
+                    pending[path] = now
+
+                ready = [p for p in pending if (now - pending[p]) >= DEBOUNCE_SECONDS]
+                for path in sorted(ready):
+                    del pending[path]
+                    self.rewrite_file(path)
+        finally:
+            watcher.close()
@@ -0,0 +1,116 @@
+"""
+Measures the latency of a single edit + re-parse of a header-heavy C file, using
+a fresh Index.parse for every edit (how lintern used to work), and using
+TranslationUnit.reparse with a precompiled preamble (how CFile works now).
+
+The C file includes all the standard C headers, plus a generated header with
+a few thousand inline function definitions, to stand in for large HAL/RTOS
+headers.
+
+Usage: python scripts/benchmark_reparse.py [num_edits]
+"""
+import os
+import sys
+import time
+import tempfile
+
+import clang.cindex
+
+from lintern.cfile import CFile, default_compiler_args, include_path_args
+
+HEADERS = [
+    'assert.h', 'ctype.h', 'errno.h', 'float.h', 'inttypes.h', 'limits.h',
+    'locale.h', 'math.h', 'setjmp.h', 'signal.h', 'stdarg.h', 'stdbool.h',
+    'stddef.h', 'stdint.h', 'stdio.h', 'stdlib.h', 'string.h', 'time.h',
+    'wchar.h', 'wctype.h'
+]
+
+GENERATED_HEADER = 'generated.h'
+GENERATED_FUNCS = 5000
+
+
+def make_header():
+    lines = []
+    for i in range(GENERATED_FUNCS):
+        lines.append('static inline int func%d(int a, int b)' % i)
+        lines.append('{')
+        lines.append('    return (a * %d) + b;' % i)
+        lines.append('}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def make_source(edit_num):
+    lines = ['#include <%s>' % h for h in HEADERS]
+    lines.append('#include "%s"' % GENERATED_HEADER)
+    lines.append('')
+    lines.append('int func(int a)')
+    lines.append('{')
+    lines.append('    int x = %d;' % edit_num)
+    lines.append('    if (a)')
+    lines.append('        x += a;')
+    lines.append('    return x;')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def bench_fresh_parse(filename, compiler_args, num_edits):
+    idx = clang.cindex.Index.create()
+    times = []
+
+    for i in range(num_edits):
+        start = time.perf_counter()
+        idx.parse(filename, args=compiler_args, unsaved_files=[(filename, make_source(i))])
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def bench_reparse(filename, compiler_args, num_edits):
+    idx = clang.cindex.Index.create()
+    times = []
+
+    start = time.perf_counter()
+    tu = idx.parse(filename, args=compiler_args, unsaved_files=[(filename, make_source(0))],
+                   options=CFile.PARSE_OPTIONS)
+    first = time.perf_counter() - start
+
+    for i in range(1, num_edits + 1):
+        start = time.perf_counter()
+        tu.reparse(unsaved_files=[(filename, make_source(i))])
+        times.append(time.perf_counter() - start)
+
+    return first, times
+
+
+def ms(seconds):
+    return seconds * 1000.0
+
+
+def main():
+    num_edits = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    compiler_args = default_compiler_args + include_path_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # libclang only uses a precompiled preamble when the main file exists
+        # on disk, so write out both the file and the header
+        filename = os.path.join(tmpdir, 'bench.c')
+        with open(filename, 'w') as fh:
+            fh.write(make_source(0))
+
+        with open(os.path.join(tmpdir, GENERATED_HEADER), 'w') as fh:
+            fh.write(make_header())
+
+        fresh = bench_fresh_parse(filename, compiler_args, num_edits)
+        first, reparse = bench_reparse(filename, compiler_args, num_edits)
+
+    print("%d edits of a file including %d system headers and %d generated inline functions\n"
+          % (num_edits, len(HEADERS), GENERATED_FUNCS))
+    print("Index.parse per edit:         %8.2f ms/edit" % ms(sum(fresh) / len(fresh)))
+    print("Initial parse with preamble:  %8.2f ms" % ms(first))
+    print("TranslationUnit.reparse:      %8.2f ms/edit" % ms(sum(reparse) / len(reparse)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
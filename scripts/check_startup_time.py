@@ -0,0 +1,96 @@
+"""
+Checks that commands which don't rewrite any files (--help, --generate-config,
+and argument errors) start quickly, and never import libclang. Each command is
+run with 'python -X importtime', and fails if any forbidden module is imported,
+or if the total time spent importing lintern and its dependencies exceeds the
+budget. The same check runs as part of the test suite (tests/test_startup.py)
+with the default budget; run this script directly to see the times, or to try
+a different budget.
+
+Usage: python scripts/check_startup_time.py [budget_ms]
+"""
+import os
+import sys
+import subprocess
+
+# Modules that must not be imported unless files are being rewritten
+FORBIDDEN_MODULES = ['clang.cindex', 'ccsyspath', 'lintern.rules', 'lintern.rewriter']
+
+DEFAULT_BUDGET_MS = 75.0
+
+COMMANDS = [
+    ['--help'],
+    ['--generate-config'],
+    ['--jobs', '0', 'file.c'],
+    []
+]
+
+
+def import_times(args):
+    """
+    Returns the names of all modules imported while running lintern with the
+    given arguments, and the total time in milliseconds spent importing modules
+    after the interpreter itself started up
+    """
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = repo_dir + os.pathsep + env.get('PYTHONPATH', '')
+
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'lintern'] + args,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          env=env, universal_newlines=True)
+
+    modules = set()
+    total_us = 0
+    started = False
+
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        fields = line[len('import time:'):].split('|')
+        if (len(fields) != 3) or (not fields[1].strip().isdigit()):
+            # Header line
+            continue
+
+        # Nested imports are indented, and listed before the module that
+        # imported them. The lintern package is imported before lintern.__main__
+        # runs, so every top-level import from then on is made by lintern.
+        name = fields[2].rstrip()
+        top_level = (len(name) - len(name.lstrip())) == 1
+        name = name.strip()
+
+        if name == 'lintern':
+            started = True
+
+        if started and top_level:
+            total_us += int(fields[1])
+
+        modules.add(name)
+
+    return modules, total_us / 1000.0
+
+
+def main():
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+    failed = False
+
+    for args in COMMANDS:
+        modules, import_ms = import_times(args)
+        desc = ' '.join(['lintern'] + args)
+        forbidden = [m for m in FORBIDDEN_MODULES if m in modules]
+
+        if forbidden:
+            print("FAIL  %-32s imported %s" % (desc, ', '.join(forbidden)))
+            failed = True
+        elif import_ms > budget_ms:
+            print("FAIL  %-32s %.1f ms (budget %.1f ms)" % (desc, import_ms, budget_ms))
+            failed = True
+        else:
+            print("OK    %-32s %.1f ms" % (desc, import_ms))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+import unittest
+
+from lintern.api import TextRewriter
+from lintern.config import get_default_config_data
+
+
+def _config():
+    # Only OneDeclarationPerLine enabled
+    config = {name: False for name in get_default_config_data()}
+    config['OneDeclarationPerLine'] = True
+    return config
+
+
+class TestTextRewriter(unittest.TestCase):
+    def test_warnings_on_success(self):
+        rewriter = TextRewriter(_config(), compiler_args=['-std=c99'])
+        result = rewriter.rewrite('#warning "check this"\nint a, b;\n')
+
+        self.assertEqual(result.new_text, '#warning "check this"\nint a;\nint b;\n')
+        self.assertEqual(result.errors, [])
+        self.assertEqual(len(result.warnings), 1)
+        self.assertIn('check this', result.warnings[0])
+
+    def test_errors_on_failure(self):
+        rewriter = TextRewriter(_config(), compiler_args=['-std=c99'])
+        result = rewriter.rewrite('#warning "check this"\nint a, b = undeclared;\n')
+
+        self.assertIsNone(result.new_text)
+        self.assertEqual(len(result.errors), 1)
+        self.assertIn('undeclared', result.errors[0])
+        self.assertEqual(len(result.warnings), 1)
+
+    def test_ignored_errors(self):
+        rewriter = TextRewriter(_config(), compiler_args=['-std=c99'], ignore_errors=True)
+        result = rewriter.rewrite('int a, b = undeclared;\n')
+
+        self.assertEqual(result.new_text, 'int a;\nint b = undeclared;\n')
+        self.assertEqual(len(result.errors), 1)
+        self.assertIn('undeclared', result.errors[0])
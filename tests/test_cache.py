@@ -0,0 +1,54 @@
+import argparse
+import tempfile
+import shutil
+import unittest
+
+from lintern.cache import ResultCache
+
+
+def _options(**kwargs):
+    args = dict(indent_type='space', indent_level=4, ignore_errors=False)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='lintern-test-cache-')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _cache(self, **kwargs):
+        return ResultCache(self.cache_dir, 1024 * 1024, ['OneDeclarationPerLine'], _options(**kwargs))
+
+    def test_hit(self):
+        self._cache().put("int a, b;\n", ['-std=c99'], "int a;\nint b;\n")
+
+        cache = self._cache()
+        self.assertEqual(cache.get("int a, b;\n", ['-std=c99']), "int a;\nint b;\n")
+        self.assertEqual(cache.hits, 1)
+
+    def test_unchanged(self):
+        self._cache().put("int a;\n", ['-std=c99'], "int a;\n")
+        self.assertEqual(self._cache().get("int a;\n", ['-std=c99']), "int a;\n")
+
+    def test_different_args(self):
+        self._cache().put("int a, b;\n", ['-std=c99'], "int a;\nint b;\n")
+        self.assertIsNone(self._cache().get("int a, b;\n", ['-std=c11']))
+
+    def test_ignore_errors_not_shared(self):
+        # A file with parse errors is only rewritten with -e, so the result
+        # must not be used by a run without -e, which should report the errors
+        text = "int a, b = ;\n"
+        self._cache(ignore_errors=True).put(text, ['-std=c99'], text)
+
+        cache = self._cache(ignore_errors=False)
+        self.assertIsNone(cache.get(text, ['-std=c99']))
+        self.assertEqual(cache.misses, 1)
+
+        self.assertEqual(self._cache(ignore_errors=True).get(text, ['-std=c99']), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
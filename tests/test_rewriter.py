@@ -0,0 +1,142 @@
+import unittest
+
+from lintern.api import TextRewriter
+from lintern.cfile import CodeChunkReplacement, ReplacementBatch
+
+
+def _rep(start, end, text='x'):
+    return CodeChunkReplacement(0, start, end, text)
+
+
+class TestReplacementBatch(unittest.TestCase):
+    def test_overlap_earlier_rule_wins(self):
+        batch = ReplacementBatch()
+        self.assertTrue(batch.add(_rep(10, 20), 2))
+        self.assertTrue(batch.add(_rep(15, 25), 0))
+
+        self.assertEqual([r.span() for r in batch.replacements], [(15, 25)])
+        self.assertEqual(batch.conflicts, 1)
+        self.assertEqual(batch.first_conflict, 2)
+
+    def test_same_edit_is_not_a_conflict(self):
+        batch = ReplacementBatch()
+        batch.add(_rep(10, 20), 0)
+        self.assertTrue(batch.add(_rep(10, 20), 0))
+
+        self.assertEqual(len(batch.replacements), 1)
+        self.assertEqual(batch.conflicts, 0)
+
+    def test_later_rules_deferred(self):
+        # Rule 1 has not finished (its nested edit was dropped), so rule 2
+        # must not have its edits applied until rule 1 has
+        batch = ReplacementBatch()
+        batch.add(_rep(0, 50), 1)
+        batch.add(_rep(10, 20), 1)
+        batch.add(_rep(60, 70), 0)
+        batch.add(_rep(80, 90), 2)
+        batch.defer_later_rules()
+
+        self.assertEqual([r.span() for r in batch.replacements], [(0, 50), (60, 70)])
+        self.assertEqual(batch.first_conflict, 1)
+        self.assertIn((80, 90), [s[:2] for s in batch.edited_spans()])
+
+    def test_finished_rules_ignored(self):
+        batch = ReplacementBatch(first_priority=1)
+        self.assertFalse(batch.add(_rep(0, 10), 0))
+        self.assertTrue(batch.add(_rep(20, 30), 1))
+
+        self.assertEqual([r.span() for r in batch.replacements], [(20, 30)])
+
+
+class TestRewriteOutput(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rewriter = TextRewriter(compiler_args=['-std=c99'])
+
+    def _rewrite(self, text):
+        result = self.rewriter.rewrite(text)
+        self.assertEqual(result.errors, [])
+        return result.new_text
+
+    def test_declarations(self):
+        # Declarations straight after ones that were split (or initialized)
+        # are split too, and keep their whole type
+        text = ("int f(void)\n"
+                "{\n"
+                "    int v0 = 46, v1 = 42, v2;\n"
+                "    long long v3 = 22, v4 = 21, v5 = 44, v6 = 39;\n"
+                "    long v7 = 43, v8 = 32;\n"
+                "    unsigned long long v9, v10 = 1;\n"
+                "    return v0 + v1 + v2 + v3 + v4 + v5 + v6 + v7 + v8 + v9 + v10;\n"
+                "}\n")
+
+        expected = ("int f(void)\n"
+                    "{\n"
+                    "    int v0 = 46;\n"
+                    "    int v1 = 42;\n"
+                    "    int v2 = 0;\n"
+                    "    long long v3 = 22;\n"
+                    "    long long v4 = 21;\n"
+                    "    long long v5 = 44;\n"
+                    "    long long v6 = 39;\n"
+                    "    long v7 = 43;\n"
+                    "    long v8 = 32;\n"
+                    "    unsigned long long v9 = 0u;\n"
+                    "    unsigned long long v10 = 1;\n"
+                    "    return v0 + v1 + v2 + v3 + v4 + v5 + v6 + v7 + v8 + v9 + v10;\n"
+                    "}\n")
+
+        self.assertEqual(self._rewrite(text), expected)
+
+    def test_declarations_with_nested_blocks(self):
+        # The nested ifs need more than one pass over the function
+        text = ("int f(int x)\n"
+                "{\n"
+                "    long v0;\n"
+                "    long long v1 = 20, v2;\n"
+                "    if (x)\n"
+                "        if (v1)\n"
+                "            v0 = 1;\n"
+                "    return v0 + v1 + v2;\n"
+                "}\n")
+
+        expected = ("int f(int x)\n"
+                    "{\n"
+                    "    long v0 = 0;\n"
+                    "    long long v1 = 20;\n"
+                    "    long long v2 = 0;\n"
+                    "    if (x)\n"
+                    "    {\n"
+                    "        if (v1)\n"
+                    "        {\n"
+                    "            v0 = 1;\n"
+                    "        }\n"
+                    "    }\n"
+                    "    return v0 + v1 + v2;\n"
+                    "}\n")
+
+        self.assertEqual(self._rewrite(text), expected)
+
+    def test_declaration_after_split_declaration(self):
+        text = ("int f(void)\n"
+                "{\n"
+                "    unsigned char v0, v1;\n"
+                "    int a = 0, b = 2, *c = 0;\n"
+                "    return a + b + v0 + v1 + (c == 0);\n"
+                "}\n")
+
+        expected = ("int f(void)\n"
+                    "{\n"
+                    "    unsigned char v0 = 0u;\n"
+                    "    unsigned char v1 = 0u;\n"
+                    "    int a = 0;\n"
+                    "    int b = 2;\n"
+                    "    int *c = 0;\n"
+                    "    return a + b + v0 + v1 + (c == 0);\n"
+                    "}\n")
+
+        self.assertEqual(self._rewrite(text), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from lintern.api import TextRewriter
+from lintern.config import get_default_config_data
+
+
+def _rewriter(rule_name):
+    # TextRewriter with only the given rule enabled
+    config = {name: False for name in get_default_config_data()}
+    config[rule_name] = True
+    return TextRewriter(config, compiler_args=['-std=c99'])
+
+
+def _function(*lines):
+    return "void f(void)\n{\n" + ''.join("    %s\n" % l for l in lines) + "}\n"
+
+
+class TestOneDeclarationPerLine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rewriter = _rewriter('OneDeclarationPerLine')
+
+    def _check(self, lines, expected_lines):
+        result = self.rewriter.rewrite(_function(*lines))
+        self.assertEqual(result.errors, [])
+        self.assertEqual(result.new_text, _function(*expected_lines))
+
+    def test_split(self):
+        self._check(["int a = 1, *b = 0, c;"],
+                    ["int a = 1;", "int *b = 0;", "int c;"])
+
+    def test_long_long(self):
+        self._check(["long long a, b;"],
+                    ["long long a;", "long long b;"])
+
+    def test_unsigned_long_long(self):
+        self._check(["unsigned long long a = 1, b;"],
+                    ["unsigned long long a = 1;", "unsigned long long b;"])
+
+    def test_qualifiers(self):
+        self._check(["static const long long a = 1, *b = 0;"],
+                    ["static const long long a = 1;", "static const long long *b = 0;"])
+
+    def test_after_split_declaration(self):
+        self._check(["int a = 1, b;", "long long c = 2, d = 3;"],
+                    ["int a = 1;", "int b;", "long long c = 2;", "long long d = 3;"])
+
+    def test_after_single_declaration(self):
+        self._check(["float fl; char *s, c;", "double a = 1, b = 2.0;"],
+                    ["float fl; char *s;", "char c;", "double a = 1;", "double b = 2.0;"])
+
+    def test_single_declaration(self):
+        self._check(["int a = 1;", "long long b;"],
+                    ["int a = 1;", "long long b;"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import argparse
+import unittest
+
+from lintern.config import get_default_config_data
+from lintern.server import LinternServer
+
+
+def _options():
+    return argparse.Namespace(indent_type='space', indent_level=4, in_place=False, check=False,
+                              ignore_errors=False, cache_dir=None, cache_size=0, stats=False,
+                              stats_format='text', trace=None, filename=[], pch=False,
+                              pch_header=None)
+
+
+def _config():
+    # Only OneDeclarationPerLine enabled
+    config = {name: False for name in get_default_config_data()}
+    config['OneDeclarationPerLine'] = True
+    return config
+
+
+class TestHandleRequest(unittest.TestCase):
+    def setUp(self):
+        self.server = LinternServer('/nonexistent/lintern.sock', _options(),
+                                    include_args=['-std=c99'])
+
+    def _request(self, text, **kwargs):
+        request = {'filename': '/nonexistent/file.c', 'text': text,
+                   'config': _config()}
+        request.update(kwargs)
+        return self.server.handle_request(request)
+
+    def test_rewrite(self):
+        response = self._request("int a, b;\n")
+        self.assertEqual(response, {'text': "int a;\nint b;\n"})
+
+    def test_invalid_config(self):
+        for config in [None, [], 'OneDeclarationPerLine', {'NoSuchRule': True}]:
+            response = self._request("int a, b;\n", config=config)
+            self.assertIn('Invalid configuration', response['error'])
+
+        # The server is still usable after rejecting the requests
+        self.assertEqual(self._request("int a, b;\n"), {'text': "int a;\nint b;\n"})
+
+    def test_ignore_errors_per_request(self):
+        text = "int a, b;\nint c = undeclared;\n"
+
+        self.assertIn('has errors', self._request(text)['error'])
+        self.assertEqual(self._request(text, ignore_errors=True),
+                         {'text': "int a;\nint b;\nint c = undeclared;\n"})
+
+        # The file is still cached, but the next request didn't ask to ignore errors
+        self.assertIn('has errors', self._request(text)['error'])
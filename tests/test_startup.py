@@ -0,0 +1,18 @@
+import unittest
+
+from scripts.check_startup_time import COMMANDS, DEFAULT_BUDGET_MS, FORBIDDEN_MODULES, import_times
+
+
+class TestStartupTime(unittest.TestCase):
+    """
+    Commands which don't rewrite any files should start quickly, and never
+    import libclang (see scripts/check_startup_time.py)
+    """
+    def test_commands(self):
+        for args in COMMANDS:
+            with self.subTest(args=args):
+                modules, import_ms = import_times(args)
+
+                self.assertIn('lintern.config', modules)
+                self.assertEqual([m for m in FORBIDDEN_MODULES if m in modules], [])
+                self.assertLessEqual(import_ms, DEFAULT_BUDGET_MS)
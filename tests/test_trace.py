@@ -0,0 +1,86 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from lintern.config import get_default_config_data
+from lintern.rewriter import CodeRewriter, rewrite_parallel
+
+
+SOURCE = """
+void func%d(void)
+{
+    int a, b;
+    a = 1;
+    b = a;
+}
+"""
+
+
+def _options(**kwargs):
+    args = dict(indent_type='space', indent_level=4, in_place=False, check=False,
+                ignore_errors=False, cache_dir=None, cache_size=0, stats=False,
+                stats_format='text', trace=None, filename=[], pch=False, pch_header=None)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='lintern-test-trace-')
+        self.tracefile = os.path.join(self.tmpdir, 'trace.json')
+
+        self.filenames = []
+        for i in range(4):
+            filename = os.path.join(self.tmpdir, 'file%d.c' % i)
+            with open(filename, 'w') as fh:
+                fh.write(SOURCE % i)
+
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _events(self):
+        with open(self.tracefile, 'r') as fh:
+            return json.load(fh)['traceEvents']
+
+    def test_spans_nested_in_file(self):
+        rewriter = CodeRewriter(_options(trace=self.tracefile, filename=self.filenames),
+                                get_default_config_data())
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            rewriter.rewrite()
+
+        rewriter.finish()
+
+        events = [e for e in self._events() if e['ph'] == 'X']
+        files = [e for e in events if e['cat'] == 'file']
+        self.assertEqual([e['name'] for e in files], self.filenames)
+
+        for e in events:
+            if e['cat'] == 'file':
+                continue
+
+            parents = [f for f in files
+                       if (f['ts'] <= e['ts']) and (e['ts'] + e['dur'] <= f['ts'] + f['dur'])]
+            self.assertEqual(len(parents), 1, e['name'])
+
+    def test_rule_events_from_workers(self):
+        args = _options(trace=self.tracefile, filename=self.filenames)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            ret = rewrite_parallel(args, get_default_config_data(), 2)
+
+        self.assertEqual(ret, 0)
+
+        events = self._events()
+        rule_events = [e for e in events if e.get('cat') == 'rule']
+        self.assertGreater(len(rule_events), 0)
+
+        # Every file is rewritten by a worker, not by the parent process
+        self.assertNotIn(os.getpid(), set(e['pid'] for e in rule_events))
@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lintern.discover import GlobFilter
+from lintern.watch import InotifyWatcher, PollingWatcher
+
+
+FILES = ['a.c', 'src/b.c', 'src/b.h', 'src/notes.txt', 'build/gen.c', 'vendor/lib/c.c']
+
+
+class TestWatchers(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='lintern-test-watch-')
+        for name in FILES:
+            self._write(name, "int a;\n")
+
+        self.glob_filter = GlobFilter(['!build/**', '!vendor'])
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _write(self, name, text):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fh:
+            fh.write(text)
+
+    def _changed(self, watcher):
+        # Paths relative to the root of everything reported until nothing changes
+        ret = set()
+        while True:
+            changed = watcher.wait(0.5)
+            if not changed:
+                return ret
+
+            ret.update(os.path.relpath(p, self.root) for p in changed)
+
+    def _check(self, watcher):
+        try:
+            for name in FILES + ['src/new/d.c', 'build/new/e.c']:
+                self._write(name, "int a, b;\n")
+
+            self.assertEqual(self._changed(watcher), {'a.c', 'src/b.c', 'src/b.h', 'src/new/d.c'})
+        finally:
+            watcher.close()
+
+    def test_polling(self):
+        self._check(PollingWatcher(self.root, self.glob_filter, interval=0.0))
+
+    def test_inotify(self):
+        try:
+            watcher = InotifyWatcher(self.root, self.glob_filter)
+        except OSError:
+            self.skipTest("inotify is not available")
+
+        self._check(watcher)